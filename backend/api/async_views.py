@@ -0,0 +1,122 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import (APIException, AuthenticationFailed,
+                                       NotAuthenticated)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+
+from core.metrics import record_cache
+from core.models import Recipe
+from .authentication import AsyncTokenAuthentication
+from .ingredient_index import ingredient_index
+from .views import IngredientViewSet, RecipeViewSet
+
+authenticator = AsyncTokenAuthentication()
+
+
+def wants_json(request):
+    # Браузерный API и ответы в других форматах отдаёт DRF
+    return ('format' not in request.GET
+            and 'text/html' not in request.META.get('HTTP_ACCEPT', ''))
+
+
+def json_response(data):
+    response = HttpResponse(JSONRenderer().render(data),
+                            content_type='application/json')
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def error_response(exc):
+    """Ошибка в том же виде, что отдаёт обработчик исключений DRF."""
+    if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+        exc.auth_header = authenticator.authenticate_header(None)
+    response = exception_handler(exc, {})
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = 'application/json'
+    response.renderer_context = {}
+    return response.render()
+
+
+async def authenticate(request):
+    """Request DRF с пользователем, найденным без блокировки цикла."""
+    drf_request = Request(request)
+    drf_request.user, drf_request.auth = (
+        await authenticator.aauthenticate(request) or (AnonymousUser(), None))
+    return drf_request
+
+
+def async_read(sync_view, read):
+    """GET с ответом в JSON обслуживает корутина read, остальное — DRF."""
+    sync_view = sync_to_async(sync_view)
+
+    async def view(request, **kwargs):
+        if request.method != 'GET' or not wants_json(request):
+            return await sync_view(request, **kwargs)
+        try:
+            return await read(request, **kwargs)
+        except (APIException, Http404) as exc:
+            return error_response(exc)
+
+    # CSRF, как и в представлениях DRF, проверяет аутентификация
+    view.csrf_exempt = True
+    return view
+
+
+async def read_ingredients(request):
+    await authenticate(request)
+    name, limit = IngredientViewSet.search_params(request.GET)
+    if not name and limit is None:
+        return IngredientViewSet.catalog_response(
+            request, await ingredient_index.asnapshot())
+    return json_response(await ingredient_index.asearch(name, limit=limit))
+
+
+async def read_recipes(request, **kwargs):
+    action = 'retrieve' if 'pk' in kwargs else 'list'
+    view = RecipeViewSet(
+        action=action, action_map={'get': action}, args=(), kwargs=kwargs,
+        format_kwarg=None, headers={})
+    key = view.response_cache_key(request, kwargs)
+    if key is not None:
+        # Кэш в памяти процесса или на /dev/shm: обращение не ждёт сети
+        cached = cache.get(key)
+        record_cache('recipe_response', cached is not None)
+        if cached is not None:
+            return view.cached_response(request, cached)
+
+    view.request = await authenticate(request)
+    queryset = view.filter_queryset(view.get_queryset())
+    if action == 'list':
+        page = await view.paginator.apaginate_queryset(
+            queryset, view.request, view=view)
+        data = view.get_paginated_response(
+            view.get_serializer(page, many=True).data).data
+    else:
+        try:
+            recipe = await queryset.aget(pk=kwargs['pk'])
+        except Recipe.DoesNotExist:
+            raise Http404
+        view.check_object_permissions(view.request, recipe)
+        data = view.get_serializer(recipe).data
+
+    response = json_response(data)
+    if key is None:
+        return response
+    return view.cached_response(request, view.cache_response(key, response))
+
+
+ingredient_list = async_read(
+    IngredientViewSet.as_view({'get': 'list'}), read_ingredients)
+recipe_list = async_read(
+    RecipeViewSet.as_view({'get': 'list', 'post': 'create'}), read_recipes)
+recipe_detail = async_read(
+    RecipeViewSet.as_view({
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+        'delete': 'destroy',
+    }),
+    read_recipes)
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.metrics import record_cache
+from core.versions import get_version, token_version_key
+
+User = get_user_model()
+
+
+class TokenCache:
+    """Ограниченный LRU «токен -> id пользователя» в памяти процесса.
+
+    Запись избавляет только от поиска токена: пользователь читается из
+    БД в каждом запросе, так что права, активность и профиль в
+    request.user всегда свежие. Запись живёт не дольше TOKEN_CACHE_TTL
+    секунд и годна, пока версия токена в кэше Django не изменилась:
+    выход и другие изменения токена и пользователя выдают ему новую
+    версию. Версия читается до запроса к БД, поэтому изменение,
+    пришедшееся на сам запрос, не оставит в кэше устаревшей записи.
+    Версию видят все воркеры только при общем кэше (см. api.checks).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, version):
+        """(id пользователя, дата создания токена) или None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user_id, created, entry_version, expires = entry
+            if entry_version != version or expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return user_id, created
+
+    def set(self, key, version, token):
+        size = settings.TOKEN_CACHE_SIZE
+        if size <= 0:
+            return
+        expires = time.monotonic() + settings.TOKEN_CACHE_TTL
+        with self._lock:
+            self._entries[key] = (token.user_id, token.created, version,
+                                  expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, запоминающая владельцев токенов.
+
+    Повторные запросы с тем же токеном читают из БД только пользователя
+    по первичному ключу; см. TokenCache.
+    """
+
+    def cached_credentials(self, key):
+        """Версия токена и запись TokenCache или None."""
+        version = get_version(token_version_key(key))
+        cached = token_cache.get(key, version)
+        record_cache('auth_token', cached is not None)
+        return version, cached
+
+    def credentials(self, key, cached, user):
+        """(пользователь, токен) по записи кэша и свежему пользователю."""
+        if user is None:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        user_id, created = cached
+        token = self.get_model().from_db(
+            DEFAULT_DB_ALIAS, ['key', 'user_id', 'created'],
+            [key, user_id, created])
+        token.user = user
+        return user, token
+
+    def authenticate_credentials(self, key):
+        version, cached = self.cached_credentials(key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, version, token)
+            return user, token
+        user = User.objects.filter(pk=cached[0]).first()
+        return self.credentials(key, cached, user)
+
+
+class AsyncTokenAuthentication(CachedTokenAuthentication):
+    """CachedTokenAuthentication с проверкой ключа через async ORM."""
+
+    def authenticate_credentials(self, key):
+        # authenticate только разбирает заголовок, ключ проверяет
+        # aauthenticate
+        return key, None
+
+    async def aauthenticate(self, request):
+        credentials = self.authenticate(request)
+        if credentials is None:
+            return None
+        key = credentials[0]
+        version, cached = self.cached_credentials(key)
+        if cached is not None:
+            user = await User.objects.filter(pk=cached[0]).afirst()
+            return self.credentials(key, cached, user)
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related('user').aget(key=key)
+        except model.DoesNotExist:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        token_cache.set(key, version, token)
+        return token.user, token
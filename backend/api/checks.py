@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Warning, register
+
+
+@register()
+def token_cache_check(app_configs, **kwargs):
+    """Кэш токенов требует общего кэша Django, иначе выход запаздывает."""
+    if settings.TOKEN_CACHE_SIZE <= 0 or not isinstance(
+            caches['default'], LocMemCache):
+        return []
+    return [Warning(
+        'TOKEN_CACHE_SIZE > 0 при кэше в памяти процесса: выход из '
+        'системы не отзывает токен в других воркерах до истечения '
+        'TOKEN_CACHE_TTL.',
+        hint='Задайте CACHE_BACKEND=file или TOKEN_CACHE_SIZE=0.',
+        id='api.W001',
+    )]
@@ -0,0 +1,51 @@
+import io
+
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+from core.constants import IMAGE_UPLOAD_MAX_SIDE, IMAGE_UPLOAD_MAX_SIZE
+
+
+class ImageUploadField(Base64ImageField):
+    """Изображение строкой base64 в JSON или файлом из multipart.
+
+    Размеры проверяются до полного декодирования: длина строки base64
+    известна заранее, а из файла Pillow читает только заголовок.
+    """
+    default_error_messages = {
+        'too_large': (f'Файл больше '
+                      f'{IMAGE_UPLOAD_MAX_SIZE // (1024 * 1024)} МБ.'),
+        'too_big': (f'Сторона изображения больше '
+                    f'{IMAGE_UPLOAD_MAX_SIDE} пикселей.'),
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            # Четыре символа base64 кодируют три байта
+            if len(data) * 3 // 4 > IMAGE_UPLOAD_MAX_SIZE:
+                self.fail('too_large')
+            return super().to_internal_value(data)
+        if not hasattr(data, 'read'):
+            self.fail('invalid')
+        if data.size > IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large')
+        self.check_dimensions(data)
+        # Загруженный файл проверяет обычное ImageField, минуя base64
+        return serializers.ImageField.to_internal_value(self, data)
+
+    def get_file_extension(self, filename, decoded_file):
+        self.check_dimensions(io.BytesIO(decoded_file))
+        return super().get_file_extension(filename, decoded_file)
+
+    def check_dimensions(self, file):
+        try:
+            width, height = Image.open(file).size
+        except Image.DecompressionBombError:
+            self.fail('too_big')
+        except (OSError, ValueError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        finally:
+            file.seek(0)
+        if max(width, height) > IMAGE_UPLOAD_MAX_SIDE:
+            self.fail('too_big')
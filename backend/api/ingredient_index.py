@@ -0,0 +1,128 @@
+import bisect
+import gzip
+import hashlib
+import threading
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError
+from rest_framework.renderers import JSONRenderer
+
+from core.catalog import aget_catalog_version, get_catalog_version
+from core.metrics import record_cache
+from core.models import Ingredient
+
+
+CatalogSnapshot = namedtuple(
+    'CatalogSnapshot', ('version', 'etag', 'body', 'gzip_body'))
+
+
+def normalize(text):
+    """Приводит строку к виду для поиска: регистр и «ё» не учитываются."""
+    return text.casefold().replace('ё', 'е').strip()
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Строки отсортированы по нормализованному названию, поэтому совпадения
+    по префиксу ищутся бинарным поиском, а по подстроке — одним проходом
+    по списку. Вместе с индексом хранится готовый снимок всего справочника
+    в JSON и gzip. Версия справочника читается из БД в каждом запросе
+    (один запрос по первичному ключу); при её смене всё перестраивается.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = ([], [], None)
+
+    def build(self, version=None):
+        if version is None:
+            version = get_catalog_version()
+        rows = sorted(
+            (
+                (normalize(name), {'id': pk, 'name': name,
+                                   'measurement_unit': unit})
+                for pk, name, unit in Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit')
+            ),
+            key=lambda row: (row[0], row[1]['measurement_unit'])
+        )
+        items = [item for _, item in rows]
+        body = JSONRenderer().render(items)
+        snapshot = CatalogSnapshot(
+            version=version,
+            etag=hashlib.sha1(body).hexdigest(),
+            body=body,
+            gzip_body=gzip.compress(body, mtime=0),
+        )
+        with self._lock:
+            self._entries = ([key for key, _ in rows], items, snapshot)
+            self._version = version
+
+    def warm_up(self):
+        """Строит индекс заранее; без доступной БД построит при запросе."""
+        try:
+            self.build()
+        except DatabaseError:
+            pass
+
+    def _is_fresh(self, version):
+        fresh = version == self._version
+        record_cache('ingredient_index', fresh)
+        return fresh
+
+    def _ensure_fresh(self):
+        version = get_catalog_version()
+        if not self._is_fresh(version):
+            self.build(version)
+
+    async def _aensure_fresh(self):
+        # Перестройка читает справочник из БД — вне цикла событий
+        version = await aget_catalog_version()
+        if not self._is_fresh(version):
+            await sync_to_async(self.build)(version)
+
+    def snapshot(self):
+        """Снимок всего справочника для отдачи без сериализации."""
+        self._ensure_fresh()
+        return self._entries[2]
+
+    async def asnapshot(self):
+        await self._aensure_fresh()
+        return self._entries[2]
+
+    def search(self, query='', limit=None):
+        """Сначала совпадения по префиксу, затем по подстроке."""
+        self._ensure_fresh()
+        return self._search(query, limit)
+
+    async def asearch(self, query='', limit=None):
+        await self._aensure_fresh()
+        return self._search(query, limit)
+
+    def _search(self, query, limit):
+        keys, rows, _ = self._entries
+        query = normalize(query)
+        if not query:
+            return rows[:limit]
+
+        start = bisect.bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        result = rows[start:end]
+        if limit is not None and len(result) >= limit:
+            return result[:limit]
+
+        for idx, key in enumerate(keys):
+            if start <= idx < end or query not in key:
+                continue
+            result.append(rows[idx])
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+
+ingredient_index = IngredientIndex()
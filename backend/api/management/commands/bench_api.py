@@ -0,0 +1,262 @@
+import io
+import itertools
+import json
+import os
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.render_shopping_cart import pdf_available
+from core.cart import bump_cart_versions
+from core.models import Ingredient, Recipe, SiteUser
+
+# Масштаб -> параметры generate_data
+SCALES = {
+    'small': {'users': 50, 'recipes': 500},
+    'medium': {'users': 500, 'recipes': 5000},
+    'large': {'users': 2000, 'recipes': 50000},
+}
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'bench_baseline.json')
+# Разница меньше этой считается шумом при любом относительном росте
+LATENCY_NOISE_MS = 1.0
+
+
+class QueryCounter:
+    """Обёртка execute: тестовый клиент очищает connection.queries."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Замер эндпоинтов API в процессе: p50/p99, число SQL-запросов '
+            'и память на запрос; сравнение с сохранёнными базовыми '
+            'значениями, рост сверх допуска завершает команду ошибкой')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', nargs='+', choices=list(SCALES),
+                            default=['small', 'medium'])
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Записать результаты как базовые')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Допустимый относительный рост p50 '
+                                 'и памяти')
+        parser.add_argument('--only', help='Только сценарии с этой '
+                                           'подстрокой в названии')
+
+    def handle(self, *args, **options):
+        ingredients = list(
+            Ingredient.objects.values_list('name', 'measurement_unit'))
+        if not ingredients:
+            raise CommandError('Справочник ингредиентов пуст, '
+                               'сначала выполните load_ingredients')
+        self.repeat = options['repeat']
+        # Данные — в отдельной БД, которая удаляется после замеров:
+        # транзакции фиксируются, и хуки on_commit выполняются, как в работе
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = {
+                scale: self.run_scale(scale, ingredients, options['only'])
+                for scale in options['scales']
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        baseline_path = options['baseline']
+        if options['save_baseline']:
+            with open(baseline_path, 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Базовые значения записаны в {baseline_path}'))
+            return
+        if not os.path.exists(baseline_path):
+            self.stdout.write(self.style.WARNING(
+                'Базовых значений нет, запустите с --save-baseline'))
+            return
+        with open(baseline_path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = list(self.compare(
+            results, baseline, options['tolerance']))
+        for message in regressions:
+            self.stderr.write(message)
+        if regressions:
+            raise CommandError(f'Регрессий: {len(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+    def run_scale(self, scale, ingredients, only):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Масштаб {scale}: {SCALES[scale]}'))
+        call_command('flush', interactive=False, verbosity=0)
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in ingredients)
+        # Свои ключи кэша: ни ответы сервера, ни прежний масштаб не мешают
+        caches = {
+            alias: {**config, 'KEY_PREFIX': f'bench_api:{scale}'}
+            for alias, config in settings.CACHES.items()
+        }
+        with override_settings(CACHES=caches):
+            call_command('generate_data', seed=9000,
+                         stdout=io.StringIO(), **SCALES[scale])
+            return self.run_scenarios(only)
+
+    def scenarios(self):
+        """Название -> функция, выполняющая запрос и возвращающая ответ."""
+        user = (SiteUser.objects.filter(email__startswith='synthetic')
+                .annotate(carts=Count('shopcart'))
+                .order_by('-carts', 'id').first())
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient(SERVER_NAME='localhost')
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        anonymous = APIClient(SERVER_NAME='localhost')
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        author_id = (SiteUser.objects.order_by('-recipes_count')
+                     .values_list('id', flat=True).first())
+        # Рецепт, которого нет ни в избранном, ни в корзине пользователя
+        spare = (Recipe.objects.exclude(favorites__user=user)
+                 .exclude(shopcarts__user=user).order_by('id').first())
+
+        scenarios = {
+            'recipes.list anon': lambda: anonymous.get('/api/recipes/'),
+            'recipes.detail anon': lambda: anonymous.get(
+                f'/api/recipes/{recipe.id}/'),
+            'recipes.detail': lambda: client.get(
+                f'/api/recipes/{recipe.id}/'),
+            'recipes.list cursor': lambda: client.get(
+                '/api/recipes/', {'paginate': 'cursor'}),
+            'ingredients.search': lambda: client.get(
+                '/api/ingredients/', {'name': 'са'}),
+            'users.subscriptions': lambda: client.get(
+                '/api/users/subscriptions/', {'recipes_limit': 3}),
+            'recipes.shopping_list': lambda: client.get(
+                '/api/recipes/shopping_list/'),
+        }
+        # Все сочетания параметров RecipeFilter
+        filters = []
+        for author, favorited, in_cart in itertools.product(
+                (None, author_id), (None, '1', '0'), (None, '1', '0')):
+            params = {
+                key: value for key, value in (
+                    ('author', author), ('is_favorited', favorited),
+                    ('is_in_shopping_cart', in_cart))
+                if value is not None
+            }
+            filters.append(params)
+            name = 'recipes.list ' + '&'.join(
+                f'{key}={"id" if key == "author" else value}'
+                for key, value in params.items())
+            scenarios[name.strip()] = (
+                lambda params=params: client.get('/api/recipes/', params))
+        self.check_filters(client, filters)
+        for action in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{spare.id}/{action}/'
+            scenarios[f'recipes.{action} toggle'] = (
+                lambda url=url: (client.post(url), client.delete(url))[1])
+        formats = ('txt', 'csv', 'pdf') if pdf_available() else ('txt', 'csv')
+        for file_format in formats:
+            # Новая версия корзины: файл каждый раз собирается заново
+            scenarios[f'recipes.download_shopping_cart {file_format}'] = (
+                lambda file_format=file_format: (
+                    bump_cart_versions([user.id]),
+                    client.get('/api/recipes/download_shopping_cart/',
+                               {'file_format': file_format}))[1])
+        return scenarios
+
+    def check_filters(self, client, filters):
+        """Фильтры сужают выдачу, иначе их сценарии замеряют весь список."""
+        def count(params):
+            return self.call(
+                lambda: client.get('/api/recipes/', params)).json()['count']
+
+        total = count({})
+        for params in filters:
+            if (('author' in params or '1' in params.values())
+                    and count(params) >= total):
+                raise CommandError(
+                    f'Фильтр {params} не сужает список рецептов')
+
+    def run_scenarios(self, only):
+        results = {}
+        self.stdout.write(
+            f'{"сценарий":<62}{"p50, мс":>9}{"p99, мс":>9}'
+            f'{"SQL":>6}{"КиБ":>9}')
+        for name, request in self.scenarios().items():
+            if only and only not in name:
+                continue
+            results[name] = self.measure(request)
+            result = results[name]
+            self.stdout.write(
+                f'{name:<62}{result["p50"]:>9.2f}{result["p99"]:>9.2f}'
+                f'{result["queries"]:>6}{result["alloc_kib"]:>9.0f}')
+        return results
+
+    def call(self, request):
+        response = request()
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{response.status_code}: {response.content[:200]!r}')
+        # Потоковые ответы рендерятся при чтении
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, request):
+        self.call(request)
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            self.call(request)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            self.call(request)
+        tracemalloc.start()
+        try:
+            self.call(request)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'p50': percentile(timings, 0.5),
+            'p99': percentile(timings, 0.99),
+            'queries': queries.count,
+            'alloc_kib': peak / 1024,
+        }
+
+    def compare(self, results, baseline, tolerance):
+        for scale, scenarios in results.items():
+            for name, result in scenarios.items():
+                base = baseline.get(scale, {}).get(name)
+                if base is None:
+                    continue
+                prefix = f'{scale} / {name}:'
+                if result['queries'] > base['queries']:
+                    yield (f'{prefix} SQL-запросов {result["queries"]}, '
+                           f'было {base["queries"]}')
+                if (result['p50'] > base['p50'] * (1 + tolerance)
+                        and result['p50'] - base['p50'] > LATENCY_NOISE_MS):
+                    yield (f'{prefix} p50 {result["p50"]:.2f} мс, '
+                           f'было {base["p50"]:.2f} мс')
+                if result['alloc_kib'] > base['alloc_kib'] * (1 + tolerance):
+                    yield (f'{prefix} память {result["alloc_kib"]:.0f} КиБ, '
+                           f'было {base["alloc_kib"]:.0f} КиБ')
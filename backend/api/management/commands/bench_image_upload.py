@@ -0,0 +1,88 @@
+import base64
+import io
+import multiprocessing
+import os
+import resource
+import tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import UserViewSet
+from core.models import SiteUser
+
+
+def noise_jpeg(side):
+    """Шум почти не сжимается — файл получается крупным, как с камеры."""
+    image = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def peak_rss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def upload(pipe, user_id, body, content_type):
+    """Загрузка аватара в дочернем процессе; в pipe — прирост пика RSS."""
+    before = peak_rss_kib()
+    request = APIRequestFactory().generic(
+        'PUT', '/api/users/me/avatar/', body, content_type)
+    force_authenticate(request, SiteUser.objects.get(pk=user_id))
+    with tempfile.TemporaryDirectory() as media_root, \
+            override_settings(MEDIA_ROOT=media_root), \
+            transaction.atomic():
+        response = UserViewSet.as_view({'put': 'avatar'})(request)
+        transaction.set_rollback(True)
+    connections.close_all()
+    pipe.send((response.status_code, peak_rss_kib() - before))
+
+
+class Command(BaseCommand):
+    help = ('Прирост пикового RSS воркера при загрузке аватара '
+            'строкой base64 в JSON и файлом в multipart')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--side', type=int, default=2000,
+                            help='Сторона изображения в пикселях')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        image = noise_jpeg(options['side'])
+        user_id = SiteUser.objects.values_list('id', flat=True).first()
+        if user_id is None:
+            raise CommandError('Нет ни одного пользователя')
+        encoded = base64.b64encode(image).decode()
+        modes = (
+            ('base64 в JSON',
+             ('{"avatar": "data:image/jpeg;base64,%s"}' % encoded).encode(),
+             'application/json'),
+            ('multipart',
+             encode_multipart(BOUNDARY, {
+                 'avatar': SimpleUploadedFile('avatar.jpg', image)}),
+             MULTIPART_CONTENT),
+        )
+        self.stdout.write(f'Файл {len(image) / 2 ** 20:.1f} МБ')
+        # Каждая загрузка — в свежем процессе, иначе пик RSS не сбросить
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        for title, body, content_type in modes:
+            growth = []
+            for _ in range(options['repeat']):
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=upload,
+                    args=(sender, user_id, body, content_type))
+                process.start()
+                status, kib = receiver.recv()
+                process.join()
+                growth.append(kib)
+            self.stdout.write(
+                f'{title:<14} статус {status}: прирост пика RSS '
+                f'{min(growth) / 1024:.1f}–{max(growth) / 1024:.1f} МБ')
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.ingredient_index import ingredient_index
+from api.serializers import IngredientSerializer
+from core.models import Ingredient
+
+DEFAULT_QUERIES = ('а', 'мо', 'сыр', 'мук', 'ка', 'соль', 'перец', 'ябл')
+
+
+class Command(BaseCommand):
+    help = 'Сравнение поиска ингредиентов: индекс в памяти и запрос к БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=DEFAULT_QUERIES)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        limit = options['limit']
+        ingredient_index.build()
+
+        def orm_search(query):
+            queryset = Ingredient.objects.filter(
+                name__icontains=query).order_by('name')
+            return IngredientSerializer(queryset[:limit], many=True).data
+
+        self.stdout.write(
+            f'{"запрос":<10}{"строк":>8}{"ORM, мс":>12}{"индекс, мс":>14}')
+        for query in options['queries']:
+            orm_ms = self.measure(orm_search, query, repeat)
+            index_ms = self.measure(
+                lambda q: ingredient_index.search(q, limit=limit),
+                query, repeat)
+            rows = len(ingredient_index.search(query, limit=limit))
+            self.stdout.write(
+                f'{query:<10}{rows:>8}{orm_ms:>12.3f}{index_ms:>14.3f}')
+
+    @staticmethod
+    def measure(func, query, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func(query)
+        return (time.perf_counter() - started) * 1000 / repeat
@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+
+from api.pagination import KeysetPagination
+from api.views import RecipeViewSet
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Сравнение времени ответа /api/recipes/ на глубокой странице: '
+            'номера страниц и курсор по ключу')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        page = options['page']
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        offset = (page - 1) * page_size
+        # Последний рецепт предыдущей страницы задаёт курсор
+        previous = (Recipe.objects
+                    .order_by(*RecipeViewSet.keyset_ordering)
+                    [offset - 1:offset].first()) if offset else None
+        if offset and previous is None:
+            raise CommandError(
+                f'Рецептов меньше, чем нужно для страницы {page}')
+
+        paginator = KeysetPagination()
+        paginator.ordering = RecipeViewSet.keyset_ordering
+        cursor = paginator.encode_cursor(previous) if previous else ''
+
+        view = RecipeViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        modes = (
+            ('номера страниц', {'page': page}),
+            ('курсор', {'paginate': 'cursor', 'cursor': cursor}),
+        )
+        for title, params in modes:
+            timings = []
+            for _ in range(options['repeat']):
+                request = factory.get('/api/recipes/', params,
+                                      HTTP_HOST='localhost')
+                started = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{title:<16} страница {page}: '
+                f'p50 {timings[len(timings) // 2]:.2f} мс, '
+                f'max {timings[-1]:.2f} мс')
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.authtoken.models import Token
+
+from core.models import Recipe, SiteUser
+
+from .bench_api import percentile
+
+SERVER_START_TIMEOUT = 30
+
+
+async def request(port, path, headers):
+    # Соединение на каждый запрос: синхронные воркеры gunicorn не держат
+    # keep-alive, так что оба режима в равных условиях
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    lines = [f'GET {path} HTTP/1.1', 'Host: localhost',
+             'Connection: close', *headers, '', '']
+    writer.write('\r\n'.join(lines).encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def load(port, path, headers, concurrency, duration):
+    timings = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await request(port, path, headers)
+            except (OSError, IndexError, ValueError):
+                status = None
+            if status is None or status >= 400:
+                errors += 1
+            else:
+                timings.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return timings, errors
+
+
+def wait_for_port(port, process):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError('gunicorn завершился при запуске')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError('gunicorn не начал принимать соединения')
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочное сравнение режимов SERVER_MODE: gunicorn с '
+            'синхронными воркерами и с воркерами uvicorn, запросы на '
+            'чтение с разной конкурентностью; пропускная способность '
+            'и задержки на заданное число воркеров')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=('wsgi', 'asgi'),
+                            default=['wsgi', 'asgi'])
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--concurrency', type=int, nargs='+',
+                            default=[1, 8, 32])
+        parser.add_argument('--duration', type=float, default=5,
+                            help='Секунд нагрузки на каждый замер')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--only', help='Только сценарии с этой '
+                                           'подстрокой в названии')
+
+    def scenarios(self):
+        recipe_id = (Recipe.objects.order_by('-favorites_count')
+                     .values_list('id', flat=True).first())
+        user = (SiteUser.objects.annotate(carts=Count('shopcart'))
+                .order_by('-carts', 'id').first())
+        if recipe_id is None or user is None:
+            raise CommandError('Нет рецептов, сначала выполните '
+                               'generate_data')
+        token, _ = Token.objects.get_or_create(user=user)
+        # С токеном ответы не берутся из кэша для анонимов
+        auth = [f'Authorization: Token {token.key}']
+        return {
+            'recipes.list': ('/api/recipes/', auth),
+            'recipes.detail': (f'/api/recipes/{recipe_id}/', auth),
+            'ingredients.search': ('/api/ingredients/?name=%D1%81%D0%B0',
+                                   auth),
+            'short_link': (f'/s/{recipe_id}', []),
+        }
+
+    def handle(self, *args, **options):
+        scenarios = {
+            name: scenario for name, scenario in self.scenarios().items()
+            if not options['only'] or options['only'] in name
+        }
+        port = options['port']
+        self.stdout.write(
+            f'{"режим":<6}{"сценарий":<22}{"клиентов":>9}{"запр./с":>10}'
+            f'{"p50, мс":>9}{"p99, мс":>9}{"ошибок":>8}')
+        for mode in options['modes']:
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn',
+                 '--bind', f'127.0.0.1:{port}',
+                 '--workers', str(options['workers'])],
+                cwd=settings.BASE_DIR, env={**os.environ, 'SERVER_MODE': mode},
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_port(port, process)
+                for name, (path, headers) in scenarios.items():
+                    # Прогрев: индекс ингредиентов, соединения с БД
+                    asyncio.run(load(port, path, headers, 1, 0.5))
+                    for concurrency in options['concurrency']:
+                        timings, errors = asyncio.run(load(
+                            port, path, headers, concurrency,
+                            options['duration']))
+                        self.report(mode, name, concurrency, timings,
+                                    errors, options['duration'])
+            finally:
+                process.terminate()
+                process.wait()
+
+    def report(self, mode, name, concurrency, timings, errors, duration):
+        if not timings:
+            self.stdout.write(f'{mode:<6}{name:<22}{concurrency:>9}'
+                              f'{"—":>10}{"—":>9}{"—":>9}{errors:>8}')
+            return
+        self.stdout.write(
+            f'{mode:<6}{name:<22}{concurrency:>9}'
+            f'{len(timings) / duration:>10.0f}'
+            f'{percentile(timings, 0.5):>9.1f}'
+            f'{percentile(timings, 0.99):>9.1f}{errors:>8}')
@@ -0,0 +1,177 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+# Целые вне BIGINT драйвер БД отвергает уже при выполнении запроса
+BIGINT_MIN, BIGINT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class KeysetPagination(BasePagination):
+    """Постраничный вывод по ключу сортировки, без COUNT(*) и OFFSET.
+
+    Курсор хранит значения полей сортировки последней записи страницы,
+    следующая страница выбирается условием «строго после курсора».
+    Порядок берётся из атрибута keyset_ordering представления.
+    """
+    ordering = ('-pub_date', '-id')
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.take_page(list(
+            self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.take_page([
+            obj async for obj in self.page_queryset(queryset, request, view)
+        ])
+
+    def page_queryset(self, queryset, request, view):
+        self.request = request
+        self.ordering = getattr(view, 'keyset_ordering', self.ordering)
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                condition = self.after(
+                    queryset.model, self.decode_cursor(cursor))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            queryset = queryset.filter(condition)
+
+        # Лишняя запись показывает, есть ли следующая страница
+        return queryset[:self.page_size + 1]
+
+    def take_page(self, page):
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.last = page[-1] if page else None
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def after(self, model, values):
+        """Условие (f1, f2, ...) строго после values в порядке сортировки."""
+        condition = Q()
+        equal = {}
+        for field_name, value in zip(self.ordering, values):
+            lookup = 'lt' if field_name.startswith('-') else 'gt'
+            name = field_name.lstrip('-')
+            value = model._meta.get_field(name).to_python(value)
+            if value is None:
+                raise ValueError(f'пустое значение {name}')
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, obj):
+        values = [
+            getattr(obj, field_name.lstrip('-'))
+            for field_name in self.ordering
+        ]
+        raw = json.dumps(
+            [value.isoformat() if hasattr(value, 'isoformat') else value
+             for value in values])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(values, list)
+                or len(values) != len(self.ordering)
+                or not all(map(self.is_cursor_value, values))):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    @staticmethod
+    def is_cursor_value(value):
+        # Курсор кодирует строки и целые; null, bool и вложенные
+        # структуры приходят только в подделанном курсоре
+        if isinstance(value, bool):
+            return False
+        if isinstance(value, int):
+            return BIGINT_MIN <= value <= BIGINT_MAX
+        return isinstance(value, str)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """PageNumberPagination с вариантом для асинхронных представлений."""
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # С известным числом записей Paginator не обращается к БД,
+        # а страница остаётся ленивым срезом запроса
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        self.page.object_list = [obj async for obj in self.page.object_list]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return list(self.page)
+
+
+class PageNumberOrKeysetPagination(BasePagination):
+    """По умолчанию номера страниц, по ?paginate=cursor — курсор по ключу."""
+    mode_query_param = 'paginate'
+    keyset_mode = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.select_paginator(request).paginate_queryset(
+            queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return await self.select_paginator(request).apaginate_queryset(
+            queryset, request, view)
+
+    def select_paginator(self, request):
+        if request.query_params.get(self.mode_query_param) == self.keyset_mode:
+            self.paginator = KeysetPagination()
+        else:
+            self.paginator = AsyncPageNumberPagination()
+        return self.paginator
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
@@ -0,0 +1,33 @@
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                             TemporaryFileUploadHandler)
+from django.http.multipartparser import MultiPartParserError
+from rest_framework.parsers import MultiPartParser
+
+from core.constants import IMAGE_UPLOAD_MAX_SIZE
+
+
+class UploadSizeLimitHandler(FileUploadHandler):
+    """Обрывает разбор тела, как только файл превысил допустимый размер."""
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > IMAGE_UPLOAD_MAX_SIZE:
+            raise MultiPartParserError(
+                f'файл {self.file_name} больше '
+                f'{IMAGE_UPLOAD_MAX_SIZE // (1024 * 1024)} МБ')
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class StreamingMultiPartParser(MultiPartParser):
+    """multipart/form-data, файлы которого пишутся на диск частями."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        # Без MemoryFileUploadHandler файл не собирается в памяти целиком
+        request.upload_handlers = [
+            UploadSizeLimitHandler(request),
+            TemporaryFileUploadHandler(request),
+        ]
+        return super().parse(stream, media_type, parser_context)
@@ -1,25 +1,121 @@
+import csv
+import io
+import itertools
+
+from django.conf import settings
+from django.core.cache import cache
 from django.utils.timezone import now
 
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:  # PDF недоступен без reportlab
+    canvas = None
+
+PDF_FONT_NAME = 'ShoppingCartFont'
+PDF_FONT_SIZE = 11
+PDF_MARGIN = 50
+
+
+def shopping_cart_header():
+    """Заголовок с текущим временем; в кэш выгрузки не попадает."""
+    return f"Список покупок на {now().strftime('%d-%m-%Y %H:%M:%S')}\n"
+
+
+def shopping_cart_lines(ingredients, recipes):
+    yield 'Продукты:\n'
+    for idx, item in enumerate(ingredients, start=1):
+        yield (
+            f"{idx}. {item['ingredient__name'].capitalize()} "
+            f"({item['ingredient__measurement_unit']}) - "
+            f"{item['total_amount']}"
+        )
+    yield '\nРецепты, использующие эти продукты:\n'
+    for recipe in recipes:
+        yield f'- {recipe.name} (@{recipe.author.username})'
+
 
 def render_shopping_cart(user, ingredients, recipes):
-    shopping_cart_header = (
-        f"Список покупок на {now().strftime('%d-%m-%Y %H:%M:%S')}\n"
-    )
-
-    ingredient_lines = [
-        f"{idx}. {item['ingredient__name'].capitalize()} "
-        f"({item['ingredient__measurement_unit']}) - {item['total_amount']}"
-        for idx, item in enumerate(ingredients, start=1)
-    ]
-
-    recipe_lines = [
-        f"- {recipe.name} (@{recipe.author.username})" for recipe in recipes
-    ]
-
-    return '\n'.join([
-        shopping_cart_header,
-        'Продукты:\n',
-        *ingredient_lines,
-        '\nРецепты, использующие эти продукты:\n',
-        *recipe_lines
-    ])
+    """Текстовый список покупок без заголовка, по строке за шаг."""
+    for line in shopping_cart_lines(ingredients, recipes):
+        yield ('\n' + line).encode()
+
+
+def render_shopping_cart_csv(user, ingredients, recipes):
+    """CSV: по строке на продукт."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk.encode()
+
+    # BOM, чтобы Excel распознал UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(('name', 'measurement_unit', 'amount'))
+    yield flush()
+    for item in ingredients:
+        writer.writerow((item['ingredient__name'],
+                         item['ingredient__measurement_unit'],
+                         item['total_amount']))
+        yield flush()
+
+
+def pdf_available():
+    return canvas is not None
+
+
+def render_shopping_cart_pdf(user, ingredients, recipes):
+    """PDF собирается reportlab целиком и отдаётся одним блоком.
+
+    Шрифт регистрируется сразу, до ответа: без файла шрифта запрос
+    завершится ошибкой, а не оборванным потоком.
+    """
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_CART_PDF_FONT))
+    return pdf_chunks(ingredients, recipes)
+
+
+def pdf_chunks(ingredients, recipes):
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    _, height = A4
+    line_height = PDF_FONT_SIZE * 1.5
+    y = height - PDF_MARGIN
+    pdf.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+    # Кэшируется целиком, поэтому без времени в заголовке
+    lines = shopping_cart_lines(ingredients, recipes)
+    for block in itertools.chain(['Список покупок\n'], lines):
+        for line in block.split('\n'):
+            if y < PDF_MARGIN:
+                pdf.showPage()
+                pdf.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            pdf.drawString(PDF_MARGIN, y, line)
+            y -= line_height
+    pdf.save()
+    yield buffer.getvalue()
+
+
+# Формат -> (рендер, content type, расширение файла, заголовок вне кэша)
+SHOPPING_CART_FORMATS = {
+    'txt': (render_shopping_cart, 'text/plain; charset=utf-8', 'txt',
+            shopping_cart_header),
+    'csv': (render_shopping_cart_csv, 'text/csv; charset=utf-8', 'csv',
+            None),
+    'pdf': (render_shopping_cart_pdf, 'application/pdf', 'pdf', None),
+}
+
+
+def cached_chunks(key, chunks, timeout):
+    """Отдаёт блоки дальше и кладёт файл в кэш, если он отдан целиком."""
+    rendered = []
+    for chunk in chunks:
+        rendered.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(rendered), timeout)
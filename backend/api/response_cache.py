@@ -0,0 +1,79 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+
+from core.constants import (RECIPE_LIST_VERSION_KEY, RECIPE_RESPONSE_CACHE_KEY,
+                            RECIPE_RESPONSE_CACHE_TIMEOUT)
+from core.metrics import record_cache
+from core.versions import get_version, recipe_version_key
+
+
+class AnonymousResponseCacheMixin:
+    """Кэш готовых ответов list и retrieve для анонимных GET-запросов.
+
+    Анониму is_favorited и is_in_shopping_cart всегда false, так что ответ
+    одинаков для всех и зависит только от строки запроса. В ключ входит
+    версия списка или рецепта из core.versions: сигналы меняют её при
+    записи рецептов, их ингредиентов и профиля автора.
+    """
+    cached_actions = ('list', 'retrieve')
+
+    def response_cache_key(self, request, kwargs):
+        action = self.action_map.get(request.method.lower())
+        if (action not in self.cached_actions
+                or 'HTTP_AUTHORIZATION' in request.META
+                # Браузерный API не кэшируем
+                or 'text/html' in request.META.get('HTTP_ACCEPT', '')):
+            return None
+        if action == 'list':
+            version = get_version(RECIPE_LIST_VERSION_KEY)
+        else:
+            pk = kwargs.get(self.lookup_url_kwarg or self.lookup_field, '')
+            if not str(pk).isdigit():
+                return None
+            version = f'{pk}:{get_version(recipe_version_key(pk))}'
+        query = urlencode(sorted(
+            (key, value)
+            for key, values in request.GET.lists() for value in values))
+        # Ссылки пагинации абсолютные, поэтому хост тоже часть ключа
+        return (f'{RECIPE_RESPONSE_CACHE_KEY}:{action}:{version}:'
+                f'{request.get_host()}:{query}')
+
+    def dispatch(self, request, *args, **kwargs):
+        key = self.response_cache_key(request, kwargs)
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        cached = cache.get(key)
+        record_cache('recipe_response', cached is not None)
+        if cached is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.render()
+            cached = self.cache_response(key, response)
+        return self.cached_response(request, cached)
+
+    @staticmethod
+    def cache_response(key, response):
+        cached = (response.content, response['Content-Type'],
+                  hashlib.sha1(response.content).hexdigest())
+        cache.set(key, cached, RECIPE_RESPONSE_CACHE_TIMEOUT)
+        return cached
+
+    @staticmethod
+    def cached_response(request, cached):
+        """Ответ из кэша; 304, если клиент прислал тот же ETag."""
+        content, content_type, etag = cached
+        etag = quote_etag(etag)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
@@ -1,18 +1,41 @@
+import json
+
 from rest_framework import serializers
-from drf_extra_fields.fields import Base64ImageField
+from rest_framework.utils import html
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from django.contrib.auth import get_user_model
-from core.models import (Ingredient, Recipe, RecipeIngredient, Favorite, ShopCart, Subscription)
-from core.constants import (MAX_RECIPES_LIMIT,
+from django.db import transaction
+from core.cart import rebuild_shopping_lists_for_recipes
+from core.models import (Ingredient, Recipe, RecipeIngredient, Subscription,
+                         ShoppingListItem)
+from core.constants import (BULK_RECIPES_MAX_COUNT, MAX_RECIPES_LIMIT,
                             RECIPE_INGREDIENT_AMOUNT_MIN_VALUE,
                             RECIPE_INGREDIENT_AMOUNT_MAX_VALUE,
                             RECIPE_COOKING_TIME_MIN_VALUE,
                             RECIPE_COOKING_TIME_MAX_VALUE
                             )
+from core.images import variant_url
+from .fields import ImageUploadField
+from .pagination import BIGINT_MAX
 
 User = get_user_model()
 
 
+class ImageVariantField(serializers.ReadOnlyField):
+    """Ссылка на уменьшенную копию изображения (см. core.images)."""
+
+    def __init__(self, field, variant, **kwargs):
+        self.field, self.variant = field, variant
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, instance):
+        url = variant_url(instance, self.field, self.variant)
+        request = self.context.get('request')
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -48,65 +71,8 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         }
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Favorite
-        fields = ('user', 'recipe')
-        read_only_fields = ('user',)
-
-    def validate(self, data):
-        user = self.context['request'].user
-        recipe = self.context['recipe']
-
-        if Favorite.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError({'status': 'Рецепт уже в избранном'})
-
-        return data
-
-    def create(self, validated_data):
-        validated_data['user'] = self.context['request'].user
-        return Favorite.objects.create(**validated_data)
-
-    def to_representation(self, instance):
-        return {
-            'id': instance.recipe.id,
-            'name': instance.recipe.name,
-            'author': instance.recipe.author.username
-        }
-
-
-class ShopCartSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ShopCart
-        fields = ('user', 'recipe')
-        read_only_fields = ('user',)
-
-    def validate(self, data):
-        """Проверка на повторное добавление."""
-        user = self.context['request'].user
-        recipe = self.context['recipe']
-
-        if ShopCart.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError({'status': 'Рецепт уже в корзине'})
-
-        return data
-
-    def create(self, validated_data):
-        """Создание записи в корзине."""
-        validated_data['user'] = self.context['request'].user
-        return ShopCart.objects.create(**validated_data)
-
-    def to_representation(self, instance):
-        """Возвращает данные о рецепте после добавления в корзину."""
-        return {
-            'id': instance.recipe.id,
-            'name': instance.recipe.name,
-            'author': instance.recipe.author.username
-        }
-
-
 class AvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField()
+    avatar = ImageUploadField()
 
     class Meta:
         model = User
@@ -115,43 +81,66 @@ class AvatarSerializer(serializers.ModelSerializer):
 
 class UserSerializer(DjoserUserSerializer):
     is_subscribed = serializers.SerializerMethodField()
-    avatar = Base64ImageField()
+    avatar = ImageUploadField()
+    avatar_thumbnail = ImageVariantField('avatar', 'thumbnail')
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username',
-                  'first_name', 'last_name', 'is_subscribed', 'avatar')
+                  'first_name', 'last_name', 'is_subscribed', 'avatar',
+                  'avatar_thumbnail')
 
     def get_is_subscribed(self, author):
+        # Значение уже посчитано в запросе (см. RecipeQuerySet)
+        is_subscribed = getattr(author, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context.get('request')
         return (request and
                 request.user.is_authenticated and
-                author.subscribers.filter(
+                author.authors.filter(
                     user=request.user).exists()
                 )
 
 
+class RecipeShortSerializer(serializers.ModelSerializer):
+    image_thumbnail = ImageVariantField('image', 'thumbnail')
+    image_webp = ImageVariantField('image', 'webp')
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'name', 'image', 'image_thumbnail', 'image_webp',
+                  'cooking_time')
+        read_only_fields = fields
+
+
 class SiteUserSerializer(UserSerializer):
-    recipes_count = serializers.IntegerField(source='recipes.count',
-                                             read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = serializers.SerializerMethodField()
 
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + ('recipes',
                                                'recipes_count')
 
-    def get_recipes(self, author):
-        recipes_limit = self.context.get('request').GET.get(
-            'recipes_limit', MAX_RECIPES_LIMIT
-        )
+    @staticmethod
+    def get_recipes_limit(request):
+        recipes_limit = request.GET.get('recipes_limit', MAX_RECIPES_LIMIT)
 
         try:
             recipes_limit = int(recipes_limit)
         except ValueError:
             recipes_limit = MAX_RECIPES_LIMIT
+        return max(recipes_limit, 0)
 
-        return RecipeSerializer(
-            author.recipes.all()[:recipes_limit],
+    def get_recipes(self, author):
+        # Рецепты уже выбраны одним оконным запросом на страницу
+        recipes = getattr(author, 'limited_recipes', None)
+        if recipes is None:
+            recipes = author.recipes.all()[:self.get_recipes_limit(
+                self.context.get('request'))]
+
+        return RecipeShortSerializer(
+            recipes,
             many=True,
             context=self.context
         ).data
@@ -163,6 +152,24 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='ingredient.id')
+    name = serializers.CharField(source='ingredient.name')
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массовых операций с корзиной и избранным."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=BIGINT_MAX),
+        allow_empty=False, max_length=BULK_RECIPES_MAX_COUNT)
+
+
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
     id = serializers.PrimaryKeyRelatedField(
         queryset=Ingredient.objects.all(), source='ingredient')
@@ -187,34 +194,103 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_thumbnail = ImageVariantField('image', 'thumbnail')
+    image_webp = ImageVariantField('image', 'webp')
 
     class Meta:
         model = Recipe
         fields = ('id', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time'
+                  'is_in_shopping_cart', 'name', 'image', 'image_thumbnail',
+                  'image_webp', 'text', 'cooking_time'
                   )
 
+    def to_representation(self, instance):
+        author_is_subscribed = getattr(instance, 'author_is_subscribed', None)
+        if author_is_subscribed is not None:
+            instance.author.is_subscribed = author_is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         return (request and request.user.is_authenticated and
                 obj.favorites.filter(user=request.user).exists()
                 )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         return (request and request.user.is_authenticated and
                 obj.shopcarts.filter(user=request.user).exists()
                 )
 
 
-class RecipeWriteSerializer(serializers.ModelSerializer):
+class RecipeIngredientsWriteMixin:
+    """Запись рецепта с ингредиентами в одной транзакции.
+
+    Сохранённые ингредиенты сравниваются с присланными: меняются только
+    изменившиеся количества, добавляются новые и удаляются лишние строки.
+    Правка без изменения состава не пишет в RecipeIngredient ничего
+    и не пересобирает списки покупок.
+    """
+
+    @transaction.atomic
+    def create(self, validated_data):
+        ingredients_data = validated_data.pop('recipe_ingredients')
+        recipe = super().create(validated_data)
+        self.save_recipe_ingredients(recipe, ingredients_data, created=True)
+        return recipe
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        ingredients_data = validated_data.pop('recipe_ingredients')
+        recipe = super().update(instance, validated_data)
+        if self.save_recipe_ingredients(recipe, ingredients_data):
+            transaction.on_commit(
+                lambda: rebuild_shopping_lists_for_recipes([recipe.pk]))
+        return recipe
+
+    def save_recipe_ingredients(self, recipe, ingredients_data,
+                                created=False):
+        """Приводит состав к присланному; True, если он изменился."""
+        submitted = {
+            ingredient['ingredient'].id: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        stored = {} if created else {
+            link.ingredient_id: link
+            for link in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        stale = [link.pk for ingredient_id, link in stored.items()
+                 if ingredient_id not in submitted]
+        changed = []
+        for ingredient_id, link in stored.items():
+            amount = submitted.get(ingredient_id, link.amount)
+            if amount != link.amount:
+                link.amount = amount
+                changed.append(link)
+        if stale:
+            RecipeIngredient.objects.filter(pk__in=stale).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        added = RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in submitted.items()
+            if ingredient_id not in stored)
+        return bool(stale or changed or added)
+
+
+class RecipeWriteSerializer(RecipeIngredientsWriteMixin,
+                            serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(
         source='recipe_ingredients',
         many=True
     )
-    image = Base64ImageField()
+    image = ImageUploadField()
 
     class Meta:
         model = Recipe
@@ -238,38 +314,31 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 "Поле 'image' не может быть пустым.")
         return data
 
-    def create(self, validated_data):
-        ingredients_data = validated_data.pop('recipe_ingredients')
-        recipe = super().create(validated_data)
-        self.create_recipe_ingredients(recipe, ingredients_data)
-        return recipe
-
-    def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('recipe_ingredients')
-        instance.recipe_ingredients.all().delete()
-        self.create_recipe_ingredients(instance, ingredients_data)
-        return super().update(instance, validated_data)
 
-    def create_recipe_ingredients(self, recipe, ingredients_data):
-        RecipeIngredient.objects.bulk_create(
-            RecipeIngredient(
-                recipe=recipe,
-                ingredient_id=ingredient['ingredient'].id,
-                amount=ingredient['amount']
-            ) for ingredient in ingredients_data)
-
-
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(RecipeIngredientsWriteMixin,
+                       serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(
         source='recipe_ingredients', many=True)
     cooking_time = serializers.IntegerField(
         min_value=RECIPE_COOKING_TIME_MIN_VALUE,
         max_value=RECIPE_COOKING_TIME_MAX_VALUE, required=True)
-    image = Base64ImageField()
+    image = ImageUploadField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
+    def to_internal_value(self, data):
+        # В multipart-форме список ингредиентов передаётся строкой JSON
+        if html.is_html_input(data) and isinstance(
+                data.get('ingredients'), str):
+            data = data.dict()
+            try:
+                data['ingredients'] = json.loads(data['ingredients'])
+            except ValueError:
+                raise serializers.ValidationError(
+                    {'ingredients': 'Ожидается список в формате JSON.'})
+        return super().to_internal_value(data)
+
     def validate(self, data):
         ingredients = data.get('recipe_ingredients')
         if not ingredients:
@@ -287,25 +356,6 @@ class RecipeSerializer(serializers.ModelSerializer):
                 "Поле 'image' не может быть пустым.")
         return data
 
-    def create(self, validated_data):
-        ingredients_data = validated_data.pop('recipe_ingredients')
-        recipe = super().create(validated_data)
-        self.create_recipe_ingredients(recipe, ingredients_data)
-        return recipe
-
-    def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('recipe_ingredients')
-        instance.recipe_ingredients.all().delete()
-        self.create_recipe_ingredients(instance, ingredients_data)
-        return super().update(instance, validated_data)
-
-    def create_recipe_ingredients(self, recipe, ingredients_data):
-        RecipeIngredient.objects.bulk_create(
-            RecipeIngredient(
-                recipe=recipe,
-                ingredient_id=ingredient['ingredient'].id,
-                amount=ingredient['amount']
-            ) for ingredient in ingredients_data)
     class Meta:
         model = Recipe
         fields = ('id', 'author', 'ingredients', 'is_favorited',
@@ -0,0 +1,232 @@
+import itertools
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from django.db import DatabaseError
+from django.utils import timezone
+
+from core.constants import (RECIPE_LIST_VERSION_KEY,
+                            SIMILAR_RECIPES_MAX_CHANGED,
+                            SIMILAR_RECIPES_SYNC_OVERLAP)
+from core.metrics import record_cache
+from core.models import Recipe, RecipeIngredient
+from core.versions import get_version
+
+# Строки разреженной матрицы «рецепт × ингредиент» (CSR): у рецепта
+# ids[i] ингредиенты cols[ptr[i]:ptr[i + 1]], столбец — id ингредиента
+Rows = namedtuple('Rows', ('ids', 'ptr', 'cols'))
+Snapshot = namedtuple(
+    'Snapshot',
+    ('base', 'scale', 'changed', 'changed_scale', 'version', 'synced_at'))
+
+
+def make_rows(ids, pairs):
+    """Rows из отсортированных id и пар (рецепт, ингредиент)."""
+    pairs = pairs[np.isin(pairs[:, 0], ids)]
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    counts = np.bincount(np.searchsorted(ids, pairs[:, 0]),
+                         minlength=len(ids))
+    return Rows(ids, np.concatenate(([0], np.cumsum(counts))), pairs[:, 1])
+
+
+def load_rows(recipes, links):
+    ids = np.fromiter(recipes.order_by('id').values_list('id', flat=True),
+                      dtype=np.int64)
+    pairs = np.fromiter(
+        itertools.chain.from_iterable(
+            links.values_list('recipe_id', 'ingredient_id')
+            .order_by().iterator(chunk_size=10000)),
+        dtype=np.int64).reshape(-1, 2)
+    return make_rows(ids, pairs)
+
+
+def row_numbers(rows):
+    """Номер строки для каждого ненулевого элемента."""
+    return np.repeat(np.arange(len(rows.ids)), np.diff(rows.ptr))
+
+
+def pairs_of(rows):
+    return np.column_stack((rows.ids[row_numbers(rows)], rows.cols))
+
+
+def select_rows(rows, mask):
+    return make_rows(rows.ids[mask], pairs_of(rows))
+
+
+def merge_rows(old, fresh):
+    """Строки old, заменённые и дополненные строками fresh."""
+    old = select_rows(old, ~np.isin(old.ids, fresh.ids))
+    return make_rows(np.union1d(old.ids, fresh.ids),
+                     np.concatenate((pairs_of(old), pairs_of(fresh))))
+
+
+def best(ids, scores, limit):
+    """Не больше limit рецептов с наибольшим ненулевым сходством."""
+    if len(scores) > limit:
+        # Искомые — в начале: с ними выбор быстр и при множестве нулей
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        ids, scores = ids[top], scores[top]
+    positive = scores > 0
+    return ids[positive], scores[positive]
+
+
+def find(ids, recipe_id):
+    index = np.searchsorted(ids, recipe_id)
+    if index < len(ids) and ids[index] == recipe_id:
+        return index
+    return None
+
+
+class BaseMatrix:
+    """Основная матрица: строки, столбцы и веса ингредиентов.
+
+    Вес ингредиента — квадрат IDF: общие для всех соль и вода почти
+    не влияют на сходство, редкие ингредиенты — сильно. Столбцы
+    (рецепты каждого ингредиента) позволяют посчитать сходство сразу
+    со всеми рецептами, перебрав только ингредиенты запроса.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        width = int(rows.cols.max()) + 1 if len(rows.cols) else 0
+        frequency = np.bincount(rows.cols, minlength=width)
+        count = len(rows.ids)
+        self.idf2 = (np.log((1 + count) / (1 + frequency)) + 1) ** 2
+        # Ингредиент, появившийся после построения, считается редчайшим
+        self.new_weight = (np.log(1 + count) + 1) ** 2
+        self.col_ptr = np.concatenate(([0], np.cumsum(frequency)))
+        self.col_rows = row_numbers(rows)[
+            np.argsort(rows.cols, kind='stable')].astype(np.int32)
+        self.scale = self.row_scale(rows)
+
+    def weights(self, cols):
+        weights = np.full(len(cols), self.new_weight)
+        known = cols < len(self.idf2)
+        weights[known] = self.idf2[cols[known]]
+        return weights
+
+    def row_scale(self, rows):
+        """Обратные нормы строк: скалярное произведение в косинус."""
+        norms = np.sqrt(np.bincount(
+            row_numbers(rows), self.weights(rows.cols),
+            minlength=len(rows.ids)))
+        # У рецепта без ингредиентов сходство всё равно нулевое
+        norms[norms == 0] = 1
+        return 1 / norms
+
+    def scores(self, cols, weights):
+        """Скалярные произведения запроса со всеми строками матрицы."""
+        known = cols < len(self.idf2)
+        starts = self.col_ptr[cols[known]]
+        ends = self.col_ptr[cols[known] + 1]
+        rows = np.concatenate(
+            [self.col_rows[start:end] for start, end in zip(starts, ends)]
+            or [np.empty(0, dtype=np.int32)])
+        return np.bincount(rows, np.repeat(weights[known], ends - starts),
+                           minlength=len(self.rows.ids))
+
+
+class SimilarRecipesIndex:
+    """Похожие рецепты по косинусу наборов ингредиентов с весами IDF.
+
+    Матрица строится один раз и живёт в памяти процесса. Когда версия
+    списка рецептов меняется, дочитываются только рецепты, изменённые
+    после прошлой сверки (по updated_at с запасом): их строки в основной
+    матрице выключаются, а новые хранятся отдельно. Удаления видны по
+    расхождению числа рецептов. Набрав SIMILAR_RECIPES_MAX_CHANGED
+    изменённых рецептов, матрица перестраивается целиком.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def build(self, version, started):
+        base = BaseMatrix(load_rows(Recipe.objects.all(),
+                                    RecipeIngredient.objects.all()))
+        empty = make_rows(np.empty(0, dtype=np.int64),
+                          np.empty((0, 2), dtype=np.int64))
+        return Snapshot(base, base.scale, empty, np.empty(0), version,
+                        started)
+
+    def sync(self, snapshot, version):
+        started = timezone.now()
+        if snapshot is None:
+            return self.build(version, started)
+        since = snapshot.synced_at - timedelta(
+            seconds=SIMILAR_RECIPES_SYNC_OVERLAP)
+        fresh = load_rows(
+            Recipe.objects.filter(updated_at__gte=since),
+            RecipeIngredient.objects.filter(recipe__updated_at__gte=since))
+        base = snapshot.base
+        changed = merge_rows(snapshot.changed, fresh)
+        # Выключенная строка основной матрицы — с нулевым множителем
+        scale = np.where(np.isin(base.rows.ids, fresh.ids), 0, snapshot.scale)
+        if (np.count_nonzero(scale) + len(changed.ids)
+                != Recipe.objects.count()):
+            existing = np.fromiter(
+                Recipe.objects.values_list('id', flat=True), dtype=np.int64)
+            scale[~np.isin(base.rows.ids, existing)] = 0
+            changed = select_rows(changed, np.isin(changed.ids, existing))
+        if len(changed.ids) > SIMILAR_RECIPES_MAX_CHANGED:
+            return self.build(version, started)
+        return Snapshot(base, scale, changed, base.row_scale(changed),
+                        version, started)
+
+    def warm_up(self):
+        """Строит матрицу заранее; без доступной БД построит при запросе."""
+        try:
+            self._ensure_fresh()
+        except DatabaseError:
+            pass
+
+    def _ensure_fresh(self):
+        version = get_version(RECIPE_LIST_VERSION_KEY)
+        snapshot = self._snapshot
+        fresh = snapshot is not None and snapshot.version == version
+        record_cache('similar_recipes', fresh)
+        if fresh:
+            return snapshot
+        with self._lock:
+            if self._snapshot is snapshot:
+                self._snapshot = self.sync(snapshot, version)
+            return self._snapshot
+
+    def similar(self, recipe_id, limit):
+        """id похожих рецептов по убыванию сходства.
+
+        None, если рецепта нет в матрице.
+        """
+        snapshot = self._ensure_fresh()
+        base, changed = snapshot.base, snapshot.changed
+        base_index = find(base.rows.ids, recipe_id)
+        index = find(changed.ids, recipe_id)
+        if index is not None:
+            cols = changed.cols[changed.ptr[index]:changed.ptr[index + 1]]
+        elif base_index is not None and snapshot.scale[base_index]:
+            cols = base.rows.cols[
+                base.rows.ptr[base_index]:base.rows.ptr[base_index + 1]]
+        else:
+            return None
+        weights = base.weights(cols)
+
+        # Норма запроса одинакова для всех кандидатов и на порядок не влияет
+        scores = base.scores(cols, weights) * snapshot.scale
+        if base_index is not None:
+            scores[base_index] = 0
+        base_ids, base_scores = best(base.rows.ids, scores, limit)
+        changed_scores = np.bincount(
+            row_numbers(changed),
+            np.where(np.isin(changed.cols, cols),
+                     base.weights(changed.cols), 0),
+            minlength=len(changed.ids)) * snapshot.changed_scale
+        changed_scores[changed.ids == recipe_id] = 0
+        ids, scores = best(np.concatenate((base_ids, changed.ids)),
+                           np.concatenate((base_scores, changed_scores)),
+                           limit)
+        return ids[np.lexsort((ids, -scores))].tolist()
+
+
+similar_recipes = SimilarRecipesIndex()
@@ -0,0 +1,737 @@
+import base64
+import io
+import json
+import tempfile
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.checks import token_cache_check
+from api.similar_recipes import SimilarRecipesIndex
+from core.counters import update_counters
+from core.images import variant_name
+from core.ingredient_sync import read_json, sync_ingredients
+from core.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                         ShopCart, ShoppingListItem, SiteUser, Subscription)
+
+
+def create_user(number):
+    return SiteUser.objects.create_user(
+        email=f'user{number}@example.com', username=f'user{number}',
+        password='Secret-pass-123', first_name='Имя', last_name='Фамилия')
+
+
+class RecipeQueryCountTest(TestCase):
+    """Число запросов списка и рецепта не зависит от числа рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.reader = create_user(2)
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(3))
+        Subscription.objects.create(user=cls.reader, author=cls.author)
+
+    def add_recipes(self, count):
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=self.author, name=f'Рецепт {number}',
+                   image='recipes/images/recipe.png', text='Описание',
+                   cooking_time=10)
+            for number in range(count))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=5)
+            for recipe in recipes for ingredient in self.ingredients)
+        update_counters(Recipe, recipes, 1)
+        links = [Favorite(user=self.reader, recipe=recipes[0]),
+                 ShopCart(user=self.reader, recipe=recipes[-1])]
+        for link in links:
+            link.save()
+        return recipes
+
+    def clients(self):
+        reader = APIClient()
+        # Без запроса токена: считаются только запросы представления
+        reader.force_authenticate(self.reader)
+        return {'anonymous': APIClient(), 'reader': reader}
+
+    def assert_queries(self, path, queries):
+        """Одно и то же число запросов при 6 и при 600 рецептах."""
+        recipe = self.add_recipes(6)[0]
+        for size in (6, 600):
+            if size > 6:
+                self.add_recipes(size - 6)
+            for name, client in self.clients().items():
+                with self.subTest(size=size, client=name):
+                    # Ответы анонимам кэшируются: замер — по пустому кэшу
+                    cache.clear()
+                    with self.assertNumQueries(queries):
+                        response = client.get(path.format(recipe.pk))
+                    self.assertEqual(response.status_code, 200)
+
+    def test_list(self):
+        # COUNT(*), страница с автором и флагами, ингредиенты
+        self.assert_queries('/api/recipes/', 3)
+
+    def test_list_by_cursor(self):
+        self.assert_queries('/api/recipes/?paginate=cursor', 2)
+
+    def test_detail(self):
+        self.assert_queries('/api/recipes/{}/', 2)
+
+    def test_malformed_cursors(self):
+        self.add_recipes(3)
+        for values in ([None, None], [1, 2], ['2020-01-01T00:00:00', None],
+                       ['2020-01-01T00:00:00', 2 ** 70], [True, 1],
+                       ['2020-01-01T00:00:00', [1]], ['nonsense', 1],
+                       {'id': 1}, [1]):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(values).encode()).decode()
+            with self.subTest(cursor=values):
+                response = APIClient().get(
+                    '/api/recipes/',
+                    {'paginate': 'cursor', 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+        response = APIClient().get(
+            '/api/recipes/', {'paginate': 'cursor', 'cursor': '%%%'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_flags(self):
+        self.add_recipes(6)
+        client = self.clients()['reader']
+        results = client.get('/api/recipes/?limit=100').json()['results']
+        self.assertEqual(sum(item['is_favorited'] for item in results), 1)
+        self.assertEqual(
+            sum(item['is_in_shopping_cart'] for item in results), 1)
+        self.assertTrue(all(item['author']['is_subscribed']
+                            for item in results))
+
+    def test_list_filters(self):
+        self.add_recipes(6)
+        client = self.clients()['reader']
+        for params, count in (
+                ({'is_favorited': 1}, 1), ({'is_favorited': 0}, 5),
+                ({'is_in_shopping_cart': 1}, 1),
+                ({'author': self.author.pk}, 6),
+                ({'author': self.reader.pk}, 0)):
+            with self.subTest(**params):
+                response = client.get('/api/recipes/', params)
+                self.assertEqual(response.json()['count'], count)
+
+
+class FeedTest(TestCase):
+    """Лента подписок: обе стратегии запроса и продолжение по курсору."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user(1)
+        authors = [create_user(number) for number in range(2, 5)]
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {number}',
+                   image='recipes/images/recipe.png', text='Описание',
+                   cooking_time=10)
+            for author in authors for number in range(4))
+        # Совпадающие даты: порядок внутри них задаёт id
+        moment = timezone.now()
+        Recipe.objects.set_pub_dates({
+            recipe.pk: moment - timedelta(minutes=number % 3)
+            for number, recipe in enumerate(recipes)})
+        for author in authors[:2]:
+            Subscription.objects.create(user=cls.reader, author=author)
+        cls.expected = list(
+            Recipe.objects.filter(author__in=authors[:2])
+            .order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def read_feed(self):
+        """id рецептов всех страниц ленты и SQL последнего запроса."""
+        client = APIClient()
+        client.force_authenticate(
+            SiteUser.objects.get(pk=self.reader.pk))
+        ids = []
+        url = '/api/recipes/feed/?limit=3'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = client.get(url).json()
+            ids += [recipe['id'] for recipe in data['results']]
+            url = data['next']
+        return ids, queries[0]['sql']
+
+    def test_few_subscriptions_use_author_index(self):
+        ids, sql = self.read_feed()
+        self.assertEqual(ids, self.expected)
+        self.assertIn('"author_id" IN (SELECT', sql)
+
+    @mock.patch('core.models.FEED_PER_AUTHOR_MAX_SUBSCRIPTIONS', 1)
+    def test_many_subscriptions_use_exists(self):
+        ids, sql = self.read_feed()
+        self.assertEqual(ids, self.expected)
+        self.assertNotIn('"author_id" IN (SELECT', sql)
+        self.assertRegex(sql, r'EXISTS\(SELECT [^)]*FROM "core_subscription"')
+
+
+class CounterTest(TestCase):
+    """Сохранение загруженного объекта не затирает счётчики."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_avatar_then_recipe_delete(self):
+        author = create_user(1)
+        client = APIClient()
+        # В author счётчик так и остаётся нулём, как в request.user
+        client.force_authenticate(author)
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', image='recipes/images/recipe.png',
+            text='Описание', cooking_time=10)
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        avatar = ('data:image/png;base64,'
+                  + base64.b64encode(buffer.getvalue()).decode())
+
+        response = client.put('/api/users/me/avatar/', {'avatar': avatar},
+                              format='json')
+        self.assertEqual(response.status_code, 200)
+        author.refresh_from_db()
+        self.assertEqual(author.recipes_count, 1)
+
+        response = client.delete(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, 204)
+        author.refresh_from_db()
+        self.assertEqual(author.recipes_count, 0)
+
+    def test_full_save_of_stale_object(self):
+        author = create_user(1)
+        stale = SiteUser.objects.get(pk=author.pk)
+        Recipe.objects.create(
+            author=author, name='Рецепт', image='recipes/images/recipe.png',
+            text='Описание', cooking_time=10)
+        saved = []
+        post_save.connect(
+            lambda update_fields, **kwargs: saved.append(update_fields),
+            sender=SiteUser, weak=False, dispatch_uid='counter-test')
+        self.addCleanup(post_save.disconnect, sender=SiteUser,
+                        dispatch_uid='counter-test')
+        stale.first_name = 'Другое'
+        stale.save()
+        self.assertEqual(saved, [None])
+        author.refresh_from_db()
+        self.assertEqual((author.first_name, author.recipes_count),
+                         ('Другое', 1))
+
+        # Как и обычный save(), удалённая строка вставляется заново
+        SiteUser.objects.filter(pk=author.pk).delete()
+        stale.save()
+        self.assertTrue(SiteUser.objects.filter(pk=author.pk).exists())
+
+
+class BulkUserRecipeTest(TestCase):
+    """Массовое добавление и удаление с пересчётом счётчиков."""
+
+    def setUp(self):
+        self.user = create_user(1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        author = create_user(2)
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        self.recipes = []
+        for amount in (2, 3):
+            recipe = Recipe.objects.create(
+                author=author, name='Рецепт',
+                image='recipes/images/recipe.png', text='Описание',
+                cooking_time=10)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=salt, amount=amount)
+            self.recipes.append(recipe)
+
+    def post(self, path, ids):
+        response = self.client.post(path, {'recipes': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [(item['id'], item['status'])
+                for item in response.json()['results']]
+
+    def counters(self, counter):
+        return [getattr(Recipe.objects.get(pk=recipe.pk), counter)
+                for recipe in self.recipes]
+
+    def test_add_and_remove(self):
+        first, second = (recipe.pk for recipe in self.recipes)
+        unknown = second + 1
+        for action, counter in (('favorite', 'favorites_count'),
+                                ('shopping_cart', 'shopping_carts_count')):
+            with self.subTest(action=action):
+                path = f'/api/recipes/{action}/'
+                # Повтор id в запросе учитывается один раз
+                self.assertEqual(self.post(path, [first, first, unknown]),
+                                 [(first, 'added'), (unknown, 'not_found')])
+                self.assertEqual(self.post(path, [second, first]),
+                                 [(second, 'added'),
+                                  (first, 'already_added')])
+                self.assertEqual(self.counters(counter), [1, 1])
+
+                self.assertEqual(
+                    self.post(f'{path}remove/', [first, first, unknown]),
+                    [(first, 'removed'), (unknown, 'not_added')])
+                self.assertEqual(self.counters(counter), [0, 1])
+                self.post(f'{path}remove/', [second])
+                self.assertEqual(self.counters(counter), [0, 0])
+
+    def test_cart_and_shopping_list(self):
+        ids = [recipe.pk for recipe in self.recipes]
+        self.post('/api/recipes/shopping_cart/', ids)
+        self.assertEqual(list(ShoppingListItem.objects.filter(
+            user=self.user).values_list('amount', flat=True)), [5])
+        self.post('/api/recipes/shopping_cart/remove/', ids[:1])
+        self.assertEqual(list(ShoppingListItem.objects.filter(
+            user=self.user).values_list('amount', flat=True)), [3])
+
+        self.post('/api/recipes/shopping_cart/', ids)
+        response = self.client.delete('/api/recipes/shopping_cart/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(ShopCart.objects.filter(user=self.user).exists())
+        self.assertFalse(
+            ShoppingListItem.objects.filter(user=self.user).exists())
+        self.assertEqual(self.counters('shopping_carts_count'), [0, 0])
+
+    def test_invalid_ids(self):
+        for ids in ([], [0], [10 ** 30], ['²'], list(range(1, 102))):
+            with self.subTest(ids=ids):
+                response = self.client.post(
+                    '/api/recipes/favorite/', {'recipes': ids},
+                    format='json')
+                self.assertEqual(response.status_code, 400)
+
+
+class UserRecipeTest(TestCase):
+    """Добавление в избранное и корзину одним запросом к БД."""
+
+    def setUp(self):
+        self.user = create_user(1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            author=create_user(2), name='Рецепт',
+            image='recipes/images/recipe.png', text='Описание',
+            cooking_time=10)
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=ingredient, amount=5)
+
+    def test_add_and_remove(self):
+        for action, counter in (('favorite', 'favorites_count'),
+                                ('shopping_cart', 'shopping_carts_count')):
+            with self.subTest(action=action):
+                path = f'/api/recipes/{self.recipe.pk}/{action}/'
+                response = self.client.post(path)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.json()['id'], self.recipe.pk)
+                self.assertEqual(self.client.post(path).status_code, 400)
+                self.recipe.refresh_from_db()
+                self.assertEqual(getattr(self.recipe, counter), 1)
+
+                self.assertEqual(self.client.delete(path).status_code, 204)
+                self.assertEqual(self.client.delete(path).status_code, 404)
+                self.recipe.refresh_from_db()
+                self.assertEqual(getattr(self.recipe, counter), 0)
+
+    def test_cart_updates_shopping_list(self):
+        path = f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        self.client.post(path)
+        self.assertEqual(list(ShoppingListItem.objects.filter(
+            user=self.user).values_list('amount', flat=True)), [5])
+        self.client.delete(path)
+        self.assertFalse(
+            ShoppingListItem.objects.filter(user=self.user).exists())
+
+    def test_unknown_recipe(self):
+        for pk in (self.recipe.pk + 1, '²', 10 ** 30):
+            for action in ('favorite', 'shopping_cart'):
+                with self.subTest(pk=pk, action=action):
+                    response = self.client.post(
+                        f'/api/recipes/{pk}/{action}/')
+                    self.assertEqual(response.status_code, 404)
+
+
+class ShoppingListTest(TestCase):
+    """Список покупок пересобирается только при смене состава рецепта."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = create_user(1)
+        self.author = create_user(2)
+        self.salt, self.sugar = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Сахар'))
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт',
+            image='recipes/images/recipe.png', text='Описание',
+            cooking_time=10)
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.salt, amount=5)
+        ShopCart.objects.create(user=self.user, recipe=self.recipe)
+
+    def shopping_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('ingredient__name', 'amount'))
+
+    def edit_recipe(self, name, ingredients):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        image = ('data:image/png;base64,'
+                 + base64.b64encode(buffer.getvalue()).decode())
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                {'name': name, 'image': image, 'text': 'Описание',
+                 'cooking_time': 10,
+                 'ingredients': [{'id': ingredient.pk, 'amount': amount}
+                                 for ingredient, amount in ingredients]},
+                format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_rename_keeps_shopping_list(self):
+        with mock.patch('core.cart.rebuild_shopping_lists') as rebuild:
+            self.edit_recipe('Другое название', [(self.salt, 5)])
+        rebuild.assert_not_called()
+        self.assertEqual(self.shopping_list(), {'Соль': 5})
+
+    def test_ingredient_change_rebuilds_shopping_list(self):
+        self.edit_recipe('Рецепт', [(self.salt, 7), (self.sugar, 2)])
+        self.assertEqual(self.shopping_list(), {'Соль': 7, 'Сахар': 2})
+        self.edit_recipe('Рецепт', [(self.sugar, 3)])
+        self.assertEqual(self.shopping_list(), {'Сахар': 3})
+
+    def test_amounts_summed_across_recipes(self):
+        soup = Recipe.objects.create(
+            author=self.author, name='Суп',
+            image='recipes/images/recipe.png', text='Описание',
+            cooking_time=10)
+        RecipeIngredient.objects.bulk_create((
+            RecipeIngredient(recipe=soup, ingredient=self.salt, amount=3),
+            RecipeIngredient(recipe=soup, ingredient=self.sugar, amount=2)))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.post(f'/api/recipes/{soup.pk}/shopping_cart/')
+        self.assertEqual(self.shopping_list(), {'Соль': 8, 'Сахар': 2})
+        client.delete(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.assertEqual(self.shopping_list(), {'Соль': 3, 'Сахар': 2})
+        client.delete(f'/api/recipes/{soup.pk}/shopping_cart/')
+        self.assertEqual(self.shopping_list(), {})
+
+    def download(self, file_format='txt'):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.get('/api/recipes/download_shopping_cart/',
+                          {'file_format': file_format})
+
+    def test_export_header_not_cached(self):
+        for hour in (10, 11):
+            moment = datetime(2024, 5, 1, hour, tzinfo=dt_timezone.utc)
+            with mock.patch('api.render_shopping_cart.now',
+                            return_value=moment):
+                content = b''.join(self.download().streaming_content)
+            header, body = content.decode().split('\n', 1)
+            self.assertEqual(header,
+                             f'Список покупок на 01-05-2024 {hour}:00:00')
+            self.assertIn('1. Соль (г) - 5', body)
+
+    def test_pdf_font_registered_before_streaming(self):
+        with mock.patch('api.render_shopping_cart.TTFont'), \
+                mock.patch('api.render_shopping_cart.pdfmetrics') as metrics:
+            metrics.getRegisteredFontNames.return_value = []
+            response = self.download('pdf')
+            metrics.registerFont.assert_called_once()
+        self.assertEqual(response.status_code, 200)
+
+    def test_recipe_ingredient_admin(self):
+        admin = SiteUser.objects.create_superuser(
+            email='admin@example.com', username='admin',
+            password='Secret-pass-123')
+        self.client.force_login(admin)
+        other = Recipe.objects.create(
+            author=self.author, name='Другой',
+            image='recipes/images/recipe.png', text='Описание',
+            cooking_time=10)
+        link = RecipeIngredient.objects.get(recipe=self.recipe)
+        path = f'/admin/core/recipeingredient/{link.pk}/'
+        for recipe, amount, expected in ((self.recipe, 9, {'Соль': 9}),
+                                         (other, 9, {})):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'{path}change/', {
+                    'recipe': recipe.pk, 'ingredient': self.salt.pk,
+                    'amount': amount})
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(self.shopping_list(), expected)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/core/recipeingredient/add/', {
+                'recipe': self.recipe.pk, 'ingredient': self.sugar.pk,
+                'amount': 4})
+        self.assertEqual(self.shopping_list(), {'Сахар': 4})
+        added = RecipeIngredient.objects.get(recipe=self.recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                f'/admin/core/recipeingredient/{added.pk}/delete/',
+                {'post': 'yes'})
+        self.assertEqual(self.shopping_list(), {})
+
+
+class RecipeAdminTest(TestCase):
+    """Список рецептов в админке с фильтром автора через автодополнение."""
+
+    def test_author_filter(self):
+        admin = SiteUser.objects.create_superuser(
+            email='admin@example.com', username='admin',
+            password='Secret-pass-123')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/core/recipe/',
+                                   {'author__id__exact': admin.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'class="autocomplete-filter"')
+        self.assertContains(response, f'value="{admin.pk}" selected')
+
+
+class ImageVariantTest(TestCase):
+    """Ссылки на копии строятся по отметке в модели."""
+
+    def test_variant_urls(self):
+        recipe = Recipe.objects.create(
+            author=create_user(1), name='Рецепт',
+            image='recipes/images/recipe.png', text='Описание',
+            cooking_time=10)
+        path = f'/api/recipes/{recipe.pk}/'
+        data = APIClient().get(path).json()
+        self.assertTrue(data['image_thumbnail'].endswith(
+            '/media/recipes/images/recipe.png'))
+
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image_variants_for=recipe.image.name)
+        cache.clear()
+        data = APIClient().get(path).json()
+        self.assertTrue(data['image_thumbnail'].endswith(
+            '/media/recipes/images/variants/recipe.png.thumbnail.webp'))
+        self.assertTrue(data['image_webp'].endswith(
+            '/media/recipes/images/variants/recipe.png.webp.webp'))
+
+    def test_variant_names_keep_extension(self):
+        self.assertNotEqual(variant_name('recipes/images/a.png', 'webp'),
+                            variant_name('recipes/images/a.jpg', 'webp'))
+
+
+class TokenCacheTest(TestCase):
+    """Кэш токенов не подменяет пользователя устаревшей копией."""
+
+    @override_settings(TOKEN_CACHE_SIZE=100)
+    def test_user_is_read_on_every_request(self):
+        user = create_user(1)
+        token = Token.objects.create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = client.get('/api/users/me/')
+        self.assertEqual(response.json()['first_name'], 'Имя')
+
+        # update() не шлёт сигналов, версия токена не меняется
+        SiteUser.objects.filter(pk=user.pk).update(first_name='Другое')
+        response = client.get('/api/users/me/')
+        self.assertEqual(response.json()['first_name'], 'Другое')
+
+        SiteUser.objects.filter(pk=user.pk).update(is_active=False)
+        self.assertEqual(client.get('/api/users/me/').status_code, 401)
+
+    def test_shared_cache_required(self):
+        with override_settings(TOKEN_CACHE_SIZE=100):
+            self.assertEqual([warning.id for warning in token_cache_check(
+                None)], ['api.W001'])
+        with override_settings(TOKEN_CACHE_SIZE=0):
+            self.assertEqual(token_cache_check(None), [])
+
+
+class IngredientCatalogTest(TestCase):
+    """Индекс справочника следует за версией в БД, а не в кэше."""
+
+    def add_ingredient(self):
+        # Команда в другом процессе: её LocMem-кэш сервер не видит
+        other_process = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'other-process',
+        }})
+        with other_process, self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def test_search_after_import(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/ingredients/?name=со').json(), [])
+        self.add_ingredient()
+        response = client.get('/api/ingredients/?name=со')
+        self.assertEqual([item['name'] for item in response.json()],
+                         ['Соль'])
+
+    def test_catalog_etag_after_import(self):
+        client = APIClient()
+        first = client.get('/api/ingredients/')
+        self.assertEqual(client.get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=first['ETag']
+        ).status_code, 304)
+        self.add_ingredient()
+        response = client.get('/api/ingredients/',
+                              HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(len(response.json()), 1)
+
+
+class IngredientSyncTest(TestCase):
+    """Справочник сверяется с файлом по паре «название, единица»."""
+
+    def test_same_name_different_units(self):
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        Ingredient.objects.create(name='соль', measurement_unit='щепотка')
+        Ingredient.objects.create(name='перец', measurement_unit='г')
+        RecipeIngredient.objects.create(
+            recipe=Recipe.objects.create(
+                author=create_user(1), name='Рецепт',
+                image='recipes/images/recipe.png', text='Описание',
+                cooking_time=10),
+            ingredient=salt, amount=1)
+        rows = [('соль', 'г'), ('соль', 'по вкусу'), ('соль', 'по вкусу'),
+                ('перец', 'шт')]
+        result = sync_ingredients(rows, sync=True)
+        self.assertEqual(
+            (result.read, result.skipped, result.inserted, result.unchanged,
+             result.stale, result.stale_in_use),
+            (4, 1, 2, 1, 2, 0))
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('соль', 'г'), ('соль', 'по вкусу'), ('перец', 'шт')})
+
+    def test_json_items_must_be_objects(self):
+        with self.assertRaises(ValueError):
+            list(read_json(io.StringIO('[{"name": "соль"}, ["перец"]]')))
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file:
+            file.write('[1]')
+            file.flush()
+            with self.assertRaises(CommandError):
+                call_command('load_ingredients', file=file.name,
+                             stdout=io.StringIO())
+
+
+class RecipeTransferTest(TestCase):
+    """Загрузка рецептов сохраняет даты и сообщает о конфликтах."""
+
+    def import_recipes(self, *records):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as file:
+            file.writelines(json.dumps(record) + '\n' for record in records)
+            file.flush()
+            call_command('import_recipes', file.name, stdout=io.StringIO())
+
+    def test_pub_date_and_username_conflict(self):
+        author = {'type': 'author', 'email': 'new@example.com',
+                  'username': 'new'}
+        recipe = {'type': 'recipe', 'author': 'new@example.com',
+                  'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+                  'pub_date': '2020-01-02T03:04:05+00:00',
+                  'image': 'recipes/images/recipe.png',
+                  'ingredients': [{'name': 'Соль', 'measurement_unit': 'г',
+                                   'amount': 5}]}
+        self.import_recipes(author, recipe)
+        self.assertEqual(Recipe.objects.get().pub_date,
+                         datetime(2020, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc))
+
+        create_user(1)
+        with self.assertRaisesMessage(CommandError, 'user1'):
+            self.import_recipes(
+                {**author, 'email': 'other@example.com', 'username': 'user1'},
+                {**recipe, 'author': 'other@example.com'})
+
+
+class SimilarRecipesTest(TestCase):
+    """Индекс похожих рецептов дочитывает правки, удаления и новые рецепты."""
+
+    def setUp(self):
+        self.author = create_user(1)
+        self.salt, self.sugar, self.rice, self.fish = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Сахар', 'Рис', 'Рыба'))
+        self.sweet = self.add_recipe(self.salt, self.sugar)
+        self.candy = self.add_recipe(self.salt, self.sugar)
+        self.sushi = self.add_recipe(self.rice, self.fish)
+        # Рецепты старше запаса сверки: дочитываются только изменённые
+        Recipe.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        self.index = SimilarRecipesIndex()
+
+    def add_recipe(self, *ingredients):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=self.author, name='Рецепт',
+                image='recipes/images/recipe.png', text='Описание',
+                cooking_time=10)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in ingredients)
+        return recipe
+
+    def test_ingredient_edited_without_recipe_save(self):
+        self.assertEqual(self.index.similar(self.sweet.pk, 10),
+                         [self.candy.pk])
+        base = self.index._snapshot.base
+        # Правка строки в RecipeIngredientAdmin: Recipe.save() не вызывается
+        link = RecipeIngredient.objects.get(recipe=self.sushi,
+                                            ingredient=self.fish)
+        link.ingredient = self.sugar
+        with self.captureOnCommitCallbacks(execute=True):
+            link.save()
+        self.assertEqual(self.index.similar(self.sweet.pk, 10),
+                         [self.candy.pk, self.sushi.pk])
+        self.assertIs(self.index._snapshot.base, base)
+        # Изменённый рецепт — в дополнительной матрице, а не в основной
+        self.assertEqual(self.index._snapshot.changed.ids.tolist(),
+                         [self.sushi.pk])
+
+    def test_new_and_deleted_recipes(self):
+        self.index.similar(self.sweet.pk, 10)
+        cake = self.add_recipe(self.salt, self.sugar, self.rice)
+        candy_id = self.candy.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.candy.delete()
+        self.assertEqual(self.index.similar(self.sweet.pk, 10), [cake.pk])
+        self.assertEqual(self.index.similar(cake.pk, 10),
+                         [self.sweet.pk, self.sushi.pk])
+        self.assertIsNone(self.index.similar(candy_id, 10))
+
+    def test_rebuild_when_too_many_changed(self):
+        self.index.similar(self.sweet.pk, 10)
+        base = self.index._snapshot.base
+        with mock.patch('api.similar_recipes.SIMILAR_RECIPES_MAX_CHANGED', 0):
+            cake = self.add_recipe(self.salt, self.sugar)
+            self.assertEqual(self.index.similar(self.sweet.pk, 10),
+                             [self.candy.pk, cake.pk])
+        self.assertIsNot(self.index._snapshot.base, base)
+        self.assertEqual(len(self.index._snapshot.changed.ids), 0)
+
+    def test_malformed_id(self):
+        for pk in ('²', 10 ** 30):
+            with self.subTest(pk=pk):
+                response = APIClient().get(f'/api/recipes/{pk}/similar/')
+                self.assertEqual(response.status_code, 404)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
@@ -12,3 +13,13 @@ urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+if settings.ASYNC_VIEWS:
+    from .async_views import ingredient_list, recipe_detail, recipe_list
+
+    # Раньше маршрутов роутера: частые чтения — асинхронно
+    urlpatterns = [
+        path('recipes/', recipe_list, name='recipe-list'),
+        path('recipes/<int:pk>/', recipe_detail, name='recipe-detail'),
+        path('ingredients/', ingredient_list, name='ingredient-list'),
+    ] + urlpatterns
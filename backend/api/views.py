@@ -1,28 +1,70 @@
-from django.http import FileResponse
+import itertools
+import re
+
+from django.http import (Http404, HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
-from django.db.models import Sum
+from django.db.models import F, Prefetch
+from django.utils.cache import patch_vary_headers
+from django.utils.http import (content_disposition_header, parse_etags,
+                               quote_etag)
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, JSONParser
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from djoser.views import UserViewSet as DjoserUserViewSet
-from core.models import (Ingredient, Recipe, RecipeIngredient,
-                         Favorite, ShopCart, Subscription)
+from django_filters.rest_framework import DjangoFilterBackend
+from core.cart import get_cart_version
+from core.constants import (SHOPPING_CART_EXPORT_KEY,
+                            SHOPPING_CART_EXPORT_TIMEOUT,
+                            SIMILAR_RECIPES_LIMIT, SIMILAR_RECIPES_MAX_LIMIT)
+from core.metrics import record_cache
+from core.models import (Ingredient, Recipe, Favorite, ShopCart,
+                         ShoppingListItem, Subscription)
+from core.user_recipes import (add_user_recipe, add_user_recipes,
+                               remove_user_recipe, remove_user_recipes)
 from .serializers import (IngredientSerializer, RecipeSerializer,
                           UserSerializer, AvatarSerializer,
-                          SiteUserSerializer, ShopCartSerializer,
-                          FavoriteSerializer, SubscriptionSerializer
+                          SiteUserSerializer, SubscriptionSerializer,
+                          ShoppingListItemSerializer, RecipeIdsSerializer
                           )
 from .filters import RecipeFilter
+from .ingredient_index import ingredient_index
+from .pagination import (BIGINT_MAX, KeysetPagination,
+                         PageNumberOrKeysetPagination)
+from .parsers import StreamingMultiPartParser
 from .permissions import IsAuthorOrReadOnly
 
-from .render_shopping_cart import render_shopping_cart
+from .response_cache import AnonymousResponseCacheMixin
+from .similar_recipes import similar_recipes
+from .render_shopping_cart import (SHOPPING_CART_FORMATS, cached_chunks,
+                                   pdf_available)
 
 
 User = get_user_model()
 
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+ALREADY_ADDED_MESSAGES = {
+    Favorite: 'Рецепт уже в избранном',
+    ShopCart: 'Рецепт уже в корзине',
+}
+
+# Изображение приходит строкой base64 в JSON или файлом в multipart
+UPLOAD_PARSER_CLASSES = (JSONParser, FormParser, StreamingMultiPartParser)
+
+
+def recipe_id_or_404(pk):
+    """id рецепта из URL; не число — 404, как у несуществующего рецепта."""
+    # isdigit() пропускает «²», который int() не разбирает
+    if not str(pk).isdecimal() or int(pk) > BIGINT_MAX:
+        raise Http404
+    return int(pk)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
@@ -37,66 +79,214 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(name__icontains=name)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        # Автодополнение обслуживается индексом в памяти; из БД читается
+        # только версия справочника
+        name, limit = self.search_params(request.GET)
+        if not name and limit is None:
+            return self.catalog_response(request, ingredient_index.snapshot())
+        return Response(ingredient_index.search(name, limit=limit))
 
-class RecipeViewSet(viewsets.ModelViewSet):
+    @staticmethod
+    def search_params(query_params):
+        """Строка поиска и limit; limit None — без ограничения."""
+        try:
+            limit = int(query_params['limit'])
+        except (KeyError, ValueError):
+            limit = None
+        if limit is not None and limit < 1:
+            limit = None
+        return query_params.get('name', ''), limit
+
+    @staticmethod
+    def catalog_response(request, snapshot):
+        """Весь справочник из готового снимка с поддержкой ETag и 304."""
+        use_gzip = ACCEPTS_GZIP_RE.search(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        # У сжатого и несжатого представлений разные сильные ETag
+        etag = quote_etag(
+            f'{snapshot.etag}-gzip' if use_gzip else snapshot.etag)
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                snapshot.gzip_body if use_gzip else snapshot.body,
+                content_type='application/json')
+            if use_gzip:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class RecipeViewSet(AnonymousResponseCacheMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthorOrReadOnly]
+    filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    pagination_class = PageNumberOrKeysetPagination
+    keyset_ordering = ('-pub_date', '-id')
+    parser_classes = UPLOAD_PARSER_CLASSES
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        return queryset.distinct()
+        return (Recipe.objects.with_related()
+                .with_user_flags(self.request.user).distinct())
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     @staticmethod
-    def handle_favorite_or_cart(request, model, serializer_class, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
+    def handle_favorite_or_cart(request, model, pk):
+        # Один INSERT или DELETE; ответ — из строки, которую вернула БД
+        recipe_id = recipe_id_or_404(pk)
         user = request.user
 
         if request.method == 'POST':
-            data = {'user': user.id, 'recipe': recipe.id}
-            serializer = serializer_class(data=data, context={'request': request, 'recipe': recipe})
-
-            # Валидация и сохранение
-            if serializer.is_valid(raise_exception=True):
-                instance = serializer.save()  # user теперь передается автоматически
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                recipe = add_user_recipe(model, user.id, recipe_id)
+            except Recipe.DoesNotExist:
+                raise Http404
+            if recipe is None:
+                raise ValidationError(
+                    {'status': [ALREADY_ADDED_MESSAGES[model]]})
+            return Response(recipe._asdict(), status=status.HTTP_201_CREATED)
 
         # Удаление рецепта из списка
-        deleted, _ = model.objects.filter(user=user, recipe=recipe).delete()
-        if deleted:
+        if remove_user_recipe(model, user.id, recipe_id):
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response({'status': 'Рецепт не найден'}, status=status.HTTP_404_NOT_FOUND)
 
-    @action(detail=True, methods=['post', 'delete'])
+    @action(detail=True, methods=['post', 'delete'],
+            permission_classes=[permissions.IsAuthenticated])
     def shopping_cart(self, request, pk=None):
-        return self.handle_favorite_or_cart(request, ShopCart, ShopCartSerializer, pk)
+        return self.handle_favorite_or_cart(request, ShopCart, pk)
 
-    @action(detail=True, methods=['post', 'delete'])
+    @action(detail=True, methods=['post', 'delete'],
+            permission_classes=[permissions.IsAuthenticated])
     def favorite(self, request, pk=None):
-        return self.handle_favorite_or_cart(request, Favorite, FavoriteSerializer, pk)
+        return self.handle_favorite_or_cart(request, Favorite, pk)
 
-    @action(detail=False, methods=['get'])
+    @staticmethod
+    def bulk_favorite_or_cart(request, model, change):
+        # Один INSERT или DELETE на весь список, результат — по каждому id
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = change(
+            model, request.user.id, serializer.validated_data['recipes'])
+        return Response({'results': [
+            {'id': pk, 'status': result} for pk, result in results.items()
+        ]})
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart', url_name='shopping-cart-bulk',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_cart_bulk(self, request):
+        if request.method == 'DELETE':
+            # Очистка корзины
+            remove_user_recipes(ShopCart, request.user.id)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.bulk_favorite_or_cart(request, ShopCart, add_user_recipes)
+
+    @action(detail=False, methods=['post'], url_path='shopping_cart/remove',
+            url_name='shopping-cart-bulk-remove',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_cart_bulk_remove(self, request):
+        return self.bulk_favorite_or_cart(
+            request, ShopCart, remove_user_recipes)
+
+    @action(detail=False, methods=['post'], url_path='favorite',
+            url_name='favorite-bulk',
+            permission_classes=[permissions.IsAuthenticated])
+    def favorite_bulk(self, request):
+        return self.bulk_favorite_or_cart(request, Favorite, add_user_recipes)
+
+    @action(detail=False, methods=['post'], url_path='favorite/remove',
+            url_name='favorite-bulk-remove',
+            permission_classes=[permissions.IsAuthenticated])
+    def favorite_bulk_remove(self, request):
+        return self.bulk_favorite_or_cart(
+            request, Favorite, remove_user_recipes)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated])
     def download_shopping_cart(self, request):
         user = request.user
-        ingredients = (
-            RecipeIngredient.objects
-            .filter(recipe__shopcarts__user=user)
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(total_amount=Sum('amount'))
-            .order_by('ingredient__name')
-        )
-        recipes = Recipe.objects.filter(shopcarts__user=user)
-        shopping_cart_text = render_shopping_cart(user, ingredients, recipes)
-        return FileResponse(shopping_cart_text, as_attachment=True,
-                            filename='shopping_cart.txt',
-                            content_type='text/plain')
+        file_format = request.query_params.get('file_format', 'txt')
+        if (file_format not in SHOPPING_CART_FORMATS
+                or file_format == 'pdf' and not pdf_available()):
+            raise ValidationError(
+                {'file_format': 'Неподдерживаемый формат файла'})
+        render, content_type, extension, header = (
+            SHOPPING_CART_FORMATS[file_format])
+
+        # Неизменённая корзина отдаётся из кэша без агрегации
+        cache_key = (f'{SHOPPING_CART_EXPORT_KEY}:{user.id}:'
+                     f'{get_cart_version(user.id)}:{file_format}')
+        content = cache.get(cache_key)
+        record_cache('shopping_cart_export', content is not None)
+        if content is not None:
+            chunks = [content]
+        else:
+            ingredients = (
+                ShoppingListItem.objects.filter(user=user)
+                .values('ingredient__name', 'ingredient__measurement_unit')
+                .annotate(total_amount=F('amount'))
+                .order_by('ingredient__name')
+            )
+            recipes = (Recipe.objects.filter(shopcarts__user=user)
+                       .select_related('author')
+                       .only('name', 'author__username'))
+            chunks = cached_chunks(
+                cache_key,
+                render(user, ingredients.iterator(), recipes.iterator()),
+                SHOPPING_CART_EXPORT_TIMEOUT)
+        if header is not None:
+            chunks = itertools.chain([header().encode()], chunks)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = content_disposition_header(
+            True, f'shopping_cart.{extension}')
+        return response
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_list(self, request):
+        items = (ShoppingListItem.objects.filter(user=request.user)
+                 .select_related('ingredient').order_by('ingredient__name'))
+        return Response(ShoppingListItemSerializer(items, many=True).data)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated],
+            pagination_class=KeysetPagination)
+    def feed(self, request):
+        # Полусоединение с подписками, страницы по курсору без COUNT(*)
+        recipes = (Recipe.objects.with_related()
+                   .with_user_flags(request.user).followed_by(request.user))
+        page = self.paginate_queryset(recipes)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        # Кандидаты и порядок — из матрицы в памяти, из БД только итог
+        recipe_id = recipe_id_or_404(pk)
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = SIMILAR_RECIPES_LIMIT
+        limit = min(max(limit, 1), SIMILAR_RECIPES_MAX_LIMIT)
+        ids = similar_recipes.similar(recipe_id, limit)
+        if ids is None:
+            # Рецепта нет в матрице: удалён или ещё не дочитан
+            get_object_or_404(Recipe.objects.only('id'), pk=recipe_id)
+            ids = []
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes],
+            many=True)
+        return Response(serializer.data)
 
     @action(detail=True, methods=['get'], url_path='get-link')
     def get_link(self, request, pk=None):
@@ -111,9 +301,12 @@ class UserViewSet(DjoserUserViewSet):
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
     lookup_field = "id"
+    # Подписки листаются по ключу в порядке оформления, новые первыми
+    keyset_ordering = ('-id',)
 
     @action(detail=False, methods=['put', 'delete'],
             permission_classes=[permissions.IsAuthenticated],
+            parser_classes=UPLOAD_PARSER_CLASSES,
             url_path='me/avatar')
     def avatar(self, request):
         user = request.user
@@ -143,14 +336,32 @@ class UserViewSet(DjoserUserViewSet):
         return Response(self.get_serializer(request.user).data)
 
     @action(detail=False, methods=['get'], permission_classes=[
-        permissions.IsAuthenticated])
+        permissions.IsAuthenticated],
+        pagination_class=PageNumberOrKeysetPagination)
     def subscriptions(self, request):
-        subscriptions = Subscription.objects.filter(
-            user=request.user).select_related('author')
-        authors = [sub.author for sub in subscriptions]
-        page = self.paginate_queryset(authors)
-        serializer = SiteUserSerializer(page, many=True,
-                                                context={'request': request})
+        recipes_limit = SiteUserSerializer.get_recipes_limit(request)
+        subscriptions = (
+            Subscription.objects.filter(user=request.user)
+            .select_related('author')
+            # Срез в Prefetch выполняется одним запросом с ROW_NUMBER()
+            .prefetch_related(Prefetch(
+                'author__recipes',
+                queryset=Recipe.objects.only(
+                    'id', 'author', 'name', 'image', 'image_variants_for',
+                    'cooking_time'
+                ).order_by('-pub_date', '-id')[:recipes_limit],
+                to_attr='limited_recipes',
+            ))
+            .order_by('-id')
+        )
+        page = self.paginate_queryset(subscriptions)
+        authors = []
+        for subscription in page:
+            author = subscription.author
+            author.is_subscribed = True
+            authors.append(author)
+        serializer = SiteUserSerializer(authors, many=True,
+                                        context={'request': request})
         return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=[
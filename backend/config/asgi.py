@@ -5,3 +5,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Прогреваем индексы ингредиентов и похожих рецептов при старте воркера
+from api.ingredient_index import ingredient_index  # noqa: E402
+from api.similar_recipes import similar_recipes  # noqa: E402
+
+ingredient_index.warm_up()
+similar_recipes.warm_up()
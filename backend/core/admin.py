@@ -1,9 +1,16 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch
 from django.utils.html import mark_safe
 from import_export.admin import ImportExportModelAdmin
 from import_export.resources import ModelResource
 
+from .cart import rebuild_shopping_lists_for_recipes
+from .catalog import bump_catalog_version
+from .images import variant_url
 from .models import (Favorite, Ingredient, Recipe, RecipeIngredient, ShopCart,
                      Subscription)
 
@@ -14,10 +21,12 @@ User = get_user_model()
 class UserAdmin(admin.ModelAdmin):
     list_display = (
         'id', 'username', 'full_name', 'email', 'avatar_preview',
-        'recipe_count', 'subscription_count', 'subscriber_count'
+        'recipes_count', 'subscriptions_count', 'subscribers_count'
     )
     search_fields = ('username', 'email')
     list_filter = ('is_staff', 'is_active')
+    # Счётчики хранятся в строке пользователя и сортируются как поля
+    show_full_result_count = False
 
     @admin.display(description="ФИО")
     def full_name(self, obj):
@@ -28,22 +37,11 @@ class UserAdmin(admin.ModelAdmin):
     def avatar_preview(self, obj):
         if obj.avatar:  # без этого выдаёт ошибку!
             return (
-                f'<img src="{obj.avatar.url}" width="50" height="50" '
+                f'<img src="{variant_url(obj, "avatar", "thumbnail")}" '
+                'width="50" height="50" '
                 'style="border-radius:50%;">'
             )
 
-    @admin.display(description="Рецептов")
-    def recipe_count(self, obj):
-        return obj.recipes.count()
-
-    @admin.display(description="Подписок")
-    def subscription_count(self, obj):
-        return obj.subscribers.count()
-
-    @admin.display(description="Подписчиков")
-    def subscriber_count(self, obj):
-        return obj.authors.count()
-
 
 class IngredientResource(ModelResource):
     class Meta:
@@ -54,6 +52,13 @@ class IngredientResource(ModelResource):
         import_mode = 1
         import_id_fields = []
 
+    def after_import(self, dataset, result, using_transactions, dry_run,
+                     **kwargs):
+        super().after_import(dataset, result, using_transactions, dry_run,
+                             **kwargs)
+        if not dry_run:
+            transaction.on_commit(bump_catalog_version)
+
 
 @admin.register(Ingredient)
 class IngredientAdmin(ImportExportModelAdmin):
@@ -69,6 +74,40 @@ class RecipeIngredientInline(admin.TabularInline):
     autocomplete_fields = ['ingredient']
 
 
+class AutocompleteListFilter(admin.FieldListFilter):
+    """Фильтр по внешнему ключу с поиском вместо списка всех значений."""
+    template = 'admin/core/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin,
+                 field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        self.lookup_val = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin,
+                         field_path)
+        self.title = field.verbose_name
+        # Виджет выбирает из БД только выбранное значение
+        form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+        self.rendered_widget = form_field.widget.render(
+            self.lookup_kwarg, self.lookup_val,
+            attrs={'id': f'id_filter_{self.lookup_kwarg}'})
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        self.base_query_string = changelist.get_query_string(
+            remove=[self.lookup_kwarg])
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': self.base_query_string,
+            'display': 'Все',
+        }
+
+
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = (
@@ -76,12 +115,33 @@ class RecipeAdmin(admin.ModelAdmin):
         'favorites_count', 'ingredients_list', 'image_preview'
     )
     search_fields = ('name', 'author__username', 'author__email')
-    list_filter = ('author', 'cooking_time')
+    list_filter = (('author', AutocompleteListFilter), 'cooking_time')
+    list_select_related = ('author',)
+    autocomplete_fields = ('author',)
+    show_full_result_count = False
     inlines = [RecipeIngredientInline]
 
-    @admin.display(description='В избранном')
-    def favorites_count(self, obj):
-        return obj.favorites.count()
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'),
+            )
+        )
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Списки покупок пересобираются, только если изменился состав
+        recipe = form.instance
+        if change and any(formset.has_changed() for formset in formsets):
+            transaction.on_commit(
+                lambda: rebuild_shopping_lists_for_recipes([recipe.pk]))
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(
+            Recipe._meta.get_field('author'), self.admin_site).media
 
     @admin.display(description='Ингредиенты')
     @mark_safe
@@ -95,7 +155,7 @@ class RecipeAdmin(admin.ModelAdmin):
     @mark_safe
     def image_preview(self, obj):
         return (
-            f'<img src="{obj.image.url}" '
+            f'<img src="{variant_url(obj, "image", "thumbnail")}" '
             'style="max-height: 100px;'
             'max-width: 100px; border-radius: 10px;" />'
         )
@@ -107,6 +167,29 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     list_filter = ('recipe', 'ingredient')
     search_fields = ('recipe__name', 'ingredient__name')
 
+    # Строка меняется без сохранения рецепта: списки покупок
+    # пересобираются здесь, а не в RecipeAdmin
+    @staticmethod
+    def rebuild_shopping_lists(recipe_ids):
+        transaction.on_commit(
+            lambda: rebuild_shopping_lists_for_recipes(recipe_ids))
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        recipe_ids = {obj.recipe_id}
+        if change and 'recipe' in form.changed_data:
+            recipe_ids.add(form.initial['recipe'])
+        self.rebuild_shopping_lists(recipe_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.rebuild_shopping_lists({obj.recipe_id})
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.rebuild_shopping_lists(recipe_ids)
+
 
 @admin.register(Favorite, ShopCart)
 class UserRecipeRelationAdmin(admin.ModelAdmin):
@@ -0,0 +1,90 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .constants import SHOPPING_CART_VERSION_KEY
+from .models import RecipeIngredient, ShopCart, ShoppingListItem
+from .versions import bump_versions, get_version
+
+
+def cart_version_key(user_id):
+    return f'{SHOPPING_CART_VERSION_KEY}:{user_id}'
+
+
+def get_cart_version(user_id):
+    """Версия корзины пользователя; меняется при любом изменении корзины."""
+    return get_version(cart_version_key(user_id))
+
+
+def bump_cart_versions(user_ids):
+    bump_versions([cart_version_key(user_id) for user_id in user_ids])
+
+
+def bump_cart_versions_for_recipe(recipe_id):
+    """Обновляет версии корзин, в которых лежит изменённый рецепт."""
+    bump_cart_versions(ShopCart.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+
+
+def change_shopping_list(user_id, recipe_id, sign):
+    """Прибавляет (sign=1) или вычитает (sign=-1) рецепт из списка покупок.
+
+    Строки создаются заранее с нулём и меняются через F(), поэтому
+    параллельные добавления в корзину не теряют друг друга.
+    """
+    amounts = dict(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', 'amount'))
+    if not amounts:
+        return
+    items = ShoppingListItem.objects.filter(user_id=user_id)
+    if sign > 0:
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                              amount=0)
+             for ingredient_id in amounts),
+            ignore_conflicts=True,
+        )
+    by_amount = defaultdict(list)
+    for ingredient_id, amount in amounts.items():
+        by_amount[amount].append(ingredient_id)
+    for amount, ingredient_ids in by_amount.items():
+        items.filter(ingredient_id__in=ingredient_ids).update(
+            amount=F('amount') + sign * amount)
+    if sign < 0:
+        items.filter(amount__lte=0).delete()
+
+
+def rebuild_shopping_lists(user_ids=None):
+    """Пересобирает списки покупок по корзинам; None — для всех."""
+    items = ShoppingListItem.objects.all()
+    totals = RecipeIngredient.objects.filter(recipe__shopcarts__isnull=False)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        items = items.filter(user_id__in=user_ids)
+        totals = RecipeIngredient.objects.filter(
+            recipe__shopcarts__user_id__in=user_ids)
+    totals = (totals.values('recipe__shopcarts__user', 'ingredient')
+              .annotate(total=Sum('amount')).order_by())
+    with transaction.atomic():
+        items.delete()
+        return len(ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=row['recipe__shopcarts__user'],
+                              ingredient_id=row['ingredient'],
+                              amount=row['total'])
+             for row in totals.iterator()),
+            batch_size=1000,
+        ))
+
+
+def rebuild_shopping_lists_for_recipes(recipe_ids):
+    """После правки состава рецептов пересобирает списки их корзин.
+
+    Версии корзин обновляются после пересборки: выгрузка, собранная
+    между ними, не закэширует старый список под новой версией.
+    """
+    user_ids = list(ShopCart.objects.filter(
+        recipe_id__in=recipe_ids).values_list('user_id', flat=True)
+        .distinct())
+    rebuild_shopping_lists(user_ids)
+    bump_cart_versions(user_ids)
@@ -0,0 +1,30 @@
+from django.db.models import F
+
+from .models import CatalogRevision
+
+# Первичный ключ единственной строки CatalogRevision
+CATALOG_REVISION_ID = 1
+
+
+def get_catalog_version():
+    """Текущая версия справочника ингредиентов.
+
+    Версия хранится в БД, а не в кэше Django: изменение, сделанное
+    командой в отдельном процессе, видят все воркеры.
+    """
+    return CatalogRevision.objects.filter(
+        pk=CATALOG_REVISION_ID).values_list('value', flat=True).first() or 0
+
+
+async def aget_catalog_version():
+    return await CatalogRevision.objects.filter(
+        pk=CATALOG_REVISION_ID).values_list('value', flat=True).afirst() or 0
+
+
+def bump_catalog_version():
+    """Отмечает, что справочник ингредиентов изменился."""
+    updated = CatalogRevision.objects.filter(
+        pk=CATALOG_REVISION_ID).update(value=F('value') + 1)
+    if not updated:
+        CatalogRevision.objects.get_or_create(
+            pk=CATALOG_REVISION_ID, defaults={'value': 1})
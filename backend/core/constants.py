@@ -22,6 +22,54 @@ RECIPE_INGREDIENT_AMOUNT_MAX_VALUE = 10000
 # Пути для загрузки изображений
 AVATAR_UPLOAD_PATH = 'avatars/'
 RECIPE_IMAGE_UPLOAD_PATH = 'recipes/images/'
+# Длина имени файла изображения, как у ImageField по умолчанию
+IMAGE_NAME_MAX_LENGTH = 100
+
+# Ограничения загружаемых изображений (тело запроса nginx — до 10 МБ)
+IMAGE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_UPLOAD_MAX_SIDE = 8000
+
+# Уменьшенные копии изображений: имя -> наибольший размер (None — исходный)
+IMAGE_VARIANTS_DIR = 'variants'
+IMAGE_VARIANT_FORMAT = 'WEBP'
+IMAGE_VARIANT_QUALITY = 80
+RECIPE_IMAGE_VARIANTS = {'thumbnail': (480, 480), 'webp': None}
+AVATAR_VARIANTS = {'thumbnail': (96, 96)}
 
 
 MAX_RECIPES_LIMIT = 10**10
+
+# Наибольшее число рецептов в одном массовом добавлении или удалении
+BULK_RECIPES_MAX_COUNT = 100
+
+# Префикс ключей версий корзин и готовых выгрузок в кэше
+SHOPPING_CART_VERSION_KEY = 'shopping-cart:version'
+SHOPPING_CART_EXPORT_KEY = 'shopping-cart:export'
+SHOPPING_CART_EXPORT_TIMEOUT = 60 * 60 * 24
+
+# Версии рецептов и страниц списка для кэша ответов анонимам
+RECIPE_LIST_VERSION_KEY = 'recipes:list-version'
+RECIPE_VERSION_KEY = 'recipes:version'
+RECIPE_RESPONSE_CACHE_KEY = 'recipes:response'
+RECIPE_RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+# Версии токенов для кэша аутентификации в памяти воркеров
+AUTH_TOKEN_VERSION_KEY = 'auth:token-version'
+
+# До стольких подписок лента читает рецепты по индексу каждого автора,
+# при большем числе — обходит рецепты по дате с проверкой подписки
+FEED_PER_AUTHOR_MAX_SUBSCRIPTIONS = 100
+
+# Похожие рецепты: сколько отдавать по умолчанию и наибольший limit
+SIMILAR_RECIPES_LIMIT = 6
+SIMILAR_RECIPES_MAX_LIMIT = 50
+# Запас по времени при дочитывании изменённых рецептов, секунд:
+# покрывает расхождение часов воркеров и долгие транзакции
+SIMILAR_RECIPES_SYNC_OVERLAP = 60
+# Сколько изменённых рецептов держать отдельно от основной матрицы,
+# прежде чем перестроить её целиком
+SIMILAR_RECIPES_MAX_CHANGED = 1000
+
+# Сколько дат публикации задавать одним UPDATE после массовой вставки:
+# CASE перебирает ветви для каждой строки, длинный замедляет запрос
+PUB_DATE_UPDATE_BATCH_SIZE = 100
@@ -0,0 +1,56 @@
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, Recipe, ShopCart, SiteUser, Subscription
+
+# Модель-связь -> [(модель со счётчиком, поле связи, поле счётчика)]
+COUNTERS = {
+    Favorite: [(Recipe, 'recipe_id', 'favorites_count')],
+    ShopCart: [(Recipe, 'recipe_id', 'shopping_carts_count')],
+    Subscription: [
+        (SiteUser, 'author_id', 'subscribers_count'),
+        (SiteUser, 'user_id', 'subscriptions_count'),
+    ],
+    Recipe: [(SiteUser, 'author_id', 'recipes_count')],
+}
+
+
+def update_counters(model, instances, delta):
+    """Изменяет счётчики на delta за каждую созданную/удалённую строку.
+
+    Подходит и для массовых операций: bulk_create и QuerySet.update
+    не отправляют сигналы, поэтому такой код вызывает функцию сам.
+    Обновление идёт через F(), одним UPDATE на каждый размер приращения.
+    """
+    for target, attname, field in COUNTERS[model]:
+        per_target = Counter(getattr(obj, attname) for obj in instances)
+        by_delta = defaultdict(list)
+        for pk, count in per_target.items():
+            by_delta[count * delta].append(pk)
+        for change, pks in by_delta.items():
+            target.objects.filter(pk__in=pks).update(
+                **{field: F(field) + change})
+
+
+def reconcile_counters():
+    """Пересчитывает все счётчики; возвращает число исправленных строк."""
+    fixed = {}
+    for model, counters in COUNTERS.items():
+        for target, attname, field in counters:
+            actual = Coalesce(
+                Subquery(
+                    model.objects.filter(**{attname: OuterRef('pk')})
+                    .order_by().values(attname)
+                    .annotate(total=Count('pk')).values('total'),
+                    output_field=IntegerField(),
+                ),
+                0,
+            )
+            drifted = target.objects.annotate(actual=actual).filter(
+                ~Q(**{field: F('actual')}))
+            fixed[f'{target.__name__}.{field}'] = (
+                target.objects.filter(pk__in=drifted.values('pk'))
+                .update(**{field: actual}))
+    return fixed
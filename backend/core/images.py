@@ -0,0 +1,118 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .constants import (IMAGE_VARIANT_FORMAT, IMAGE_VARIANT_QUALITY,
+                        IMAGE_VARIANTS_DIR)
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_VARIANT_WORKERS,
+    thread_name_prefix='image-variants')
+
+
+def variant_name(name, variant):
+    """recipes/images/a.png -> recipes/images/variants/a.png.thumbnail.webp
+
+    Расширение остаётся в имени: у a.png и a.jpg копии разные.
+    """
+    directory, filename = os.path.split(name)
+    return os.path.join(
+        directory, IMAGE_VARIANTS_DIR,
+        f'{filename}.{variant}.{IMAGE_VARIANT_FORMAT.lower()}')
+
+
+def variants_field(field):
+    """Поле с именем файла, для которого копии field уже созданы."""
+    return f'{field}_variants_for'
+
+
+def variant_url(instance, field, variant):
+    """Ссылка на копию, а пока её нет — на исходный файл.
+
+    Готовность копий записана в модели, хранилище не опрашивается.
+    """
+    image = getattr(instance, field)
+    if not image:
+        return None
+    if getattr(instance, variants_field(field)) == image.name:
+        return image.storage.url(variant_name(image.name, variant))
+    return image.url
+
+
+def mark_variants_ready(queryset, field, name):
+    """Отмечает копии файла name готовыми; False, если уже отмечены.
+
+    Запись, файл которой успели сменить, не отмечается.
+    """
+    marker = variants_field(field)
+    return bool(
+        queryset.filter(**{field: name}).exclude(**{marker: name})
+        .update(**{marker: name}))
+
+
+def encode_variant(image, size):
+    if size is not None:
+        # JPEG декодируется сразу в уменьшенном масштабе
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size, Image.LANCZOS)
+    else:
+        image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert(
+            'RGBA' if 'A' in image.getbands()
+            or 'transparency' in image.info else 'RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, IMAGE_VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_variants(name, variants, force=False, storage=default_storage):
+    """Создаёт недостающие копии изображения, возвращает их число."""
+    missing = {
+        variant: size for variant, size in variants.items()
+        if force or not storage.exists(variant_name(name, variant))
+    }
+    for variant, size in missing.items():
+        target = variant_name(name, variant)
+        with storage.open(name, 'rb') as source:
+            content = encode_variant(Image.open(source), size)
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, content)
+    return len(missing)
+
+
+def _generate_in_background(name, variants, on_ready):
+    try:
+        generate_variants(name, variants)
+        if on_ready is not None:
+            on_ready()
+    except Exception:
+        logger.exception('Не удалось создать копии изображения %s', name)
+    finally:
+        # Соединения с БД у каждого потока свои
+        connections.close_all()
+
+
+def schedule_variants(name, variants, on_ready=None):
+    """Ставит создание копий в фоновый поток после фиксации транзакции.
+
+    Запрос не ждёт перекодирования: до его окончания variant_url отдаёт
+    исходный файл. on_ready вызывается, когда все копии есть, — отметить
+    их готовыми и сбросить закэшированные ответы.
+    """
+    if not name:
+        return
+    transaction.on_commit(
+        lambda: _executor.submit(
+            _generate_in_background, name, variants, on_ready))
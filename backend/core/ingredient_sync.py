@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+from collections import namedtuple
+from itertools import islice
+
+from django.db import connection, transaction
+
+from .catalog import bump_catalog_version
+from .constants import (INGREDIENT_MEASUREMENT_UNIT_MAX_LENGTH,
+                        INGREDIENT_NAME_MAX_LENGTH)
+from .models import Ingredient, RecipeIngredient
+
+SyncResult = namedtuple(
+    'SyncResult',
+    ('read', 'skipped', 'inserted', 'unchanged', 'stale', 'stale_in_use'))
+
+STAGING_TABLE = 'ingredient_sync'
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    reader = csv.DictReader(file)
+    if not {'name', 'measurement_unit'} <= set(reader.fieldnames or ()):
+        raise ValueError('В CSV нет столбцов name и measurement_unit')
+    for row in reader:
+        yield row['name'], row['measurement_unit']
+
+
+def read_json(file):
+    """Читает JSON-массив объектов по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Ожидается JSON-массив')
+    offset, eof = 1, False
+    while True:
+        # Пропускаем пробелы и запятые между объектами
+        while offset < len(buffer) and buffer[offset] in ' \t\r\n,':
+            offset += 1
+        if buffer[offset:offset + 1] == ']':
+            return
+        try:
+            item, offset = decoder.raw_decode(buffer, offset)
+        except ValueError:
+            if eof:
+                raise ValueError('Некорректный JSON')
+            chunk = file.read(JSON_CHUNK_SIZE)
+            eof = not chunk
+            buffer, offset = buffer[offset:] + chunk, 0
+            continue
+        if not isinstance(item, dict):
+            raise ValueError(f'Ожидается объект, получено: {item!r}')
+        yield item.get('name'), item.get('measurement_unit')
+
+
+READERS = {'csv': read_csv, 'json': read_json}
+
+
+def clean_rows(rows, stats):
+    """Отбрасывает пустые и слишком длинные значения, нумерует строки."""
+    for line, (name, unit) in enumerate(rows):
+        stats['read'] += 1
+        name, unit = (name or '').strip(), (unit or '').strip()
+        if (not name or not unit
+                or len(name) > INGREDIENT_NAME_MAX_LENGTH
+                or len(unit) > INGREDIENT_MEASUREMENT_UNIT_MAX_LENGTH):
+            stats['skipped'] += 1
+            continue
+        yield line, name, unit
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def load_staging(cursor, rows, batch_size):
+    """Заливает строки во временную таблицу: в PostgreSQL — через COPY."""
+    for batch in batches(rows, batch_size):
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY {STAGING_TABLE} (line, name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)', buffer)
+        else:
+            cursor.executemany(
+                f'INSERT INTO {STAGING_TABLE} '
+                '(line, name, measurement_unit) VALUES (%s, %s, %s)',
+                batch)
+
+
+def sync_ingredients(rows, sync=False, batch_size=10000):
+    """Сверяет справочник ингредиентов с потоком строк (name, unit).
+
+    Ключ — пара (название, единица), как в unique_name_measurement_unit:
+    новые пары добавляются, а при sync пары, которых нет в файле и
+    которые не используются в рецептах, удаляются. Сравнение идёт
+    запросами над временной таблицей, поэтому память не зависит от
+    размера файла.
+    """
+    qn = connection.ops.quote_name
+    table = qn(Ingredient._meta.db_table)
+    usage = qn(RecipeIngredient._meta.db_table)
+    usage_fk = qn(RecipeIngredient._meta.get_field('ingredient').column)
+    stats = {'read': 0, 'skipped': 0}
+    # Временная таблица создаётся в транзакции: при ошибке её не станет
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {STAGING_TABLE} ('
+            'line integer NOT NULL, '
+            f'name varchar({INGREDIENT_NAME_MAX_LENGTH}) NOT NULL, '
+            'measurement_unit '
+            f'varchar({INGREDIENT_MEASUREMENT_UNIT_MAX_LENGTH}) NOT NULL)')
+        load_staging(cursor, clean_rows(rows, stats), batch_size)
+        cursor.execute(
+            f'CREATE INDEX {STAGING_TABLE}_name '
+            f'ON {STAGING_TABLE} (name, measurement_unit, line)')
+        # Повтор пары в файле: остаётся последняя строка
+        cursor.execute(
+            f'DELETE FROM {STAGING_TABLE} WHERE line < ('
+            f'SELECT MAX(s.line) FROM {STAGING_TABLE} s '
+            f'WHERE s.name = {STAGING_TABLE}.name '
+            f'AND s.measurement_unit = {STAGING_TABLE}.measurement_unit)')
+        duplicates = cursor.rowcount
+        cursor.execute(
+            f'SELECT COUNT(*) FROM {STAGING_TABLE} s JOIN {table} i '
+            'ON i.name = s.name '
+            'AND i.measurement_unit = s.measurement_unit')
+        unchanged = cursor.fetchone()[0]
+
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            f'SELECT s.name, s.measurement_unit FROM {STAGING_TABLE} s '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {table} i '
+            'WHERE i.name = s.name '
+            'AND i.measurement_unit = s.measurement_unit)')
+        inserted = cursor.rowcount
+
+        # Пары, которых нет в файле; используемые в рецептах остаются
+        stale = (
+            f'FROM {table} WHERE NOT EXISTS (SELECT 1 '
+            f'FROM {STAGING_TABLE} s WHERE s.name = {table}.name '
+            f'AND s.measurement_unit = {table}.measurement_unit) '
+            f'AND {{}} EXISTS (SELECT 1 FROM {usage} ri '
+            f'WHERE ri.{usage_fk} = {table}.id)')
+        if sync:
+            cursor.execute('DELETE ' + stale.format('NOT'))
+            stale_count = cursor.rowcount
+        else:
+            cursor.execute('SELECT COUNT(*) ' + stale.format('NOT'))
+            stale_count = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) ' + stale.format(''))
+        stale_in_use = cursor.fetchone()[0]
+        cursor.execute(f'DROP TABLE {STAGING_TABLE}')
+        # Массовые запросы идут мимо сигналов — сбрасываем кэш сами.
+        # Удаляются только неиспользуемые пары, рецептов это не меняет
+        if inserted or sync and stale_count:
+            transaction.on_commit(bump_catalog_version)
+    return SyncResult(
+        read=stats['read'], skipped=stats['skipped'] + duplicates,
+        inserted=inserted, unchanged=unchanged, stale=stale_count,
+        stale_in_use=stale_in_use)
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe
+from core.recipe_transfer import export_recipes
+
+
+class Command(BaseCommand):
+    help = ('Выгрузка рецептов с ингредиентами и авторами в NDJSON; '
+            'изображения выгружаются ссылками')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', help='Файл для выгрузки, по умолчанию stdout')
+        parser.add_argument(
+            '--author', action='append', metavar='EMAIL',
+            help='Только рецепты этих авторов')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        queryset = Recipe.objects.all()
+        if options['author']:
+            queryset = queryset.filter(author__email__in=options['author'])
+        output = options['output']
+        file = (open(output, 'w', encoding='utf-8') if output
+                else sys.stdout)
+        try:
+            lines = 0
+            for line in export_recipes(queryset, options['batch_size']):
+                file.write(line)
+                lines += 1
+        finally:
+            if output:
+                file.close()
+        if output:
+            self.stdout.write(self.style.SUCCESS(
+                f'Выгружено строк: {lines} в {output}'))
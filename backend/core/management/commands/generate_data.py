@@ -0,0 +1,207 @@
+import io
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.timezone import now
+from PIL import Image
+
+from core.cart import rebuild_shopping_lists
+from core.constants import RECIPE_IMAGE_UPLOAD_PATH
+from core.counters import reconcile_counters
+from core.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                         ShopCart, SiteUser, Subscription)
+from core.versions import bump_recipe_versions
+
+SYNTHETIC_PASSWORD = 'synthetic-password'
+SYNTHETIC_IMAGE = RECIPE_IMAGE_UPLOAD_PATH + 'synthetic.png'
+
+
+def power_law_weights(count, exponent):
+    """Накопленные веса 1/rank^exponent для random.choices."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, count + 1)))
+
+
+def batches(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Генерация синтетических пользователей, рецептов, избранного, '
+            'корзин и подписок для нагрузочного тестирования')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--favorites', type=float, default=20,
+                            help='В среднем рецептов в избранном у '
+                                 'пользователя')
+        parser.add_argument('--carts', type=float, default=3,
+                            help='В среднем рецептов в корзине')
+        parser.add_argument('--subscriptions', type=float, default=5,
+                            help='В среднем подписок у пользователя')
+        parser.add_argument('--ingredients-per-recipe', type=int,
+                            nargs=2, default=(3, 12), metavar=('MIN', 'MAX'))
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Показатель распределения ингредиентов')
+        parser.add_argument('--popularity', type=float, default=1.2,
+                            help='Показатель популярности авторов '
+                                 'и рецептов')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.options = options
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError('Справочник ингредиентов пуст, '
+                               'сначала выполните load_ingredients')
+        prefix = f'synthetic{options["seed"]}'
+        if SiteUser.objects.filter(email__startswith=prefix + '-').exists():
+            raise CommandError(f'Данные с --seed {options["seed"]} '
+                               'уже сгенерированы')
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            user_ids = self.create_users(prefix, options['users'])
+            # Популярность автора не связана с порядком создания
+            authors = user_ids[:]
+            self.rng.shuffle(authors)
+            recipe_ids = self.create_recipes(authors, ingredient_ids)
+            popular_recipes = recipe_ids[:]
+            self.rng.shuffle(popular_recipes)
+            recipe_weights = power_law_weights(
+                len(popular_recipes), options['popularity'])
+            author_weights = power_law_weights(
+                len(authors), options['popularity'])
+            for model, average in ((Favorite, options['favorites']),
+                                   (ShopCart, options['carts'])):
+                self.create_relations(
+                    model, user_ids, 'recipe_id', popular_recipes,
+                    recipe_weights, average)
+            self.create_relations(
+                Subscription, user_ids, 'author_id', authors,
+                author_weights, options['subscriptions'])
+            # Массовые вставки идут мимо сигналов
+            reconcile_counters()
+            rebuild_shopping_lists(user_ids)
+            transaction.on_commit(lambda: bump_recipe_versions([]))
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.1f} с'))
+
+    def report(self, model, count):
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {count}')
+
+    def create_users(self, prefix, count):
+        # Хеш считается один раз: все пользователи входят с одним паролем
+        password = make_password(SYNTHETIC_PASSWORD)
+        user_ids = []
+        for batch in batches(range(count), self.batch_size):
+            user_ids.extend(user.pk for user in SiteUser.objects.bulk_create(
+                SiteUser(
+                    email=f'{prefix}-{number}@example.com',
+                    username=f'{prefix}-{number}',
+                    first_name='Пользователь',
+                    last_name=str(number),
+                    password=password,
+                )
+                for number in batch
+            ))
+        self.report(SiteUser, len(user_ids))
+        return user_ids
+
+    def synthetic_image(self):
+        if not default_storage.exists(SYNTHETIC_IMAGE):
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 64), 'orange').save(buffer, 'PNG')
+            default_storage.save(SYNTHETIC_IMAGE,
+                                 ContentFile(buffer.getvalue()))
+        return SYNTHETIC_IMAGE
+
+    def create_recipes(self, authors, ingredient_ids):
+        rng = self.rng
+        image = self.synthetic_image()
+        low, high = self.options['ingredients_per_recipe']
+        # Частые ингредиенты — случайные, а не первые по алфавиту
+        ingredients = ingredient_ids[:]
+        rng.shuffle(ingredients)
+        ingredient_weights = power_law_weights(
+            len(ingredients), self.options['zipf'])
+        author_weights = power_law_weights(
+            len(authors), self.options['popularity'])
+        started = now()
+        recipe_ids = []
+        links = 0
+        for batch in batches(range(self.options['recipes']),
+                             self.batch_size):
+            recipes = [
+                Recipe(
+                    author_id=author_id,
+                    name=f'Рецепт {number}',
+                    text=f'Описание рецепта {number}',
+                    cooking_time=rng.randint(5, 180),
+                    image=image,
+                    pub_date=started - timedelta(
+                        minutes=rng.randint(0, 60 * 24 * 365)),
+                )
+                for number, author_id in zip(batch, rng.choices(
+                    authors, cum_weights=author_weights, k=len(batch)))
+            ]
+            # bulk_create подставит текущее время (auto_now_add)
+            pub_dates = [recipe.pub_date for recipe in recipes]
+            Recipe.objects.bulk_create(recipes)
+            Recipe.objects.set_pub_dates({
+                recipe.pk: pub_date
+                for recipe, pub_date in zip(recipes, pub_dates)})
+            recipe_links = []
+            for recipe in recipes:
+                chosen = set(rng.choices(
+                    ingredients, cum_weights=ingredient_weights,
+                    k=rng.randint(low, high)))
+                recipe_links.extend(
+                    RecipeIngredient(recipe_id=recipe.pk,
+                                     ingredient_id=ingredient_id,
+                                     amount=rng.randint(1, 500))
+                    for ingredient_id in chosen)
+            for links_batch in batches(recipe_links, self.batch_size):
+                RecipeIngredient.objects.bulk_create(links_batch)
+            links += len(recipe_links)
+            recipe_ids.extend(recipe.pk for recipe in recipes)
+        self.report(Recipe, len(recipe_ids))
+        self.report(RecipeIngredient, links)
+        return recipe_ids
+
+    def create_relations(self, model, user_ids, target_field, targets,
+                         weights, average):
+        """Связи пользователей с популярными по степенному закону целями."""
+        rng = self.rng
+
+        def rows():
+            for user_id in user_ids:
+                # Экспоненциальное распределение: у многих мало, у немногих
+                # много; в среднем — average
+                count = min(int(rng.expovariate(1 / average)), len(targets))
+                chosen = set(rng.choices(
+                    targets, cum_weights=weights, k=count))
+                chosen.discard(user_id if model is Subscription else None)
+                for target in chosen:
+                    yield model(user_id=user_id, **{target_field: target})
+
+        created = 0
+        if average > 0 and targets:
+            for batch in batches(rows(), self.batch_size):
+                model.objects.bulk_create(batch)
+                created += len(batch)
+        self.report(model, created)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from core.constants import AVATAR_VARIANTS, RECIPE_IMAGE_VARIANTS
+from core.images import generate_variants, mark_variants_ready
+from core.models import Recipe, SiteUser
+from core.versions import bump_recipe_versions
+
+
+class Command(BaseCommand):
+    help = ('Создание недостающих уменьшенных копий изображений '
+            'рецептов и аватаров')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать и уже существующие копии')
+
+    def handle(self, *args, force=False, **options):
+        sources = (
+            (Recipe.objects.exclude(image=''), 'image',
+             RECIPE_IMAGE_VARIANTS),
+            (SiteUser.objects.exclude(avatar='').exclude(avatar=None),
+             'avatar', AVATAR_VARIANTS),
+        )
+        created = marked = failed = 0
+        for queryset, field, variants in sources:
+            for pk, name in queryset.values_list('pk', field).iterator():
+                try:
+                    created += generate_variants(name, variants, force)
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                marked += mark_variants_ready(
+                    queryset.filter(pk=pk), field, name)
+        # Ответы анонимам могли закэшироваться со ссылками на оригиналы
+        if created or marked:
+            bump_recipe_versions(
+                Recipe.objects.values_list('id', flat=True))
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано копий: {created}, отмечено записей: {marked}, '
+            f'ошибок: {failed}'))
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from core.recipe_transfer import RecipeImporter
+
+
+class Command(BaseCommand):
+    help = ('Загрузка рецептов из NDJSON, созданного export_recipes; '
+            'файлы изображений переносятся отдельно')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file', nargs='?', help='Файл NDJSON, по умолчанию stdin')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['file']
+        file = open(path, encoding='utf-8') if path else sys.stdin
+        try:
+            result = RecipeImporter(options['batch_size']).load(file)
+        except (ValueError, IntegrityError) as error:
+            raise CommandError(f'Загрузка отменена, {error}')
+        finally:
+            if path:
+                file.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Авторов создано: {result.authors}\n'
+            f'Рецептов загружено: {result.recipes}, '
+            f'уже были: {result.skipped}\n'
+            f'Ингредиентов в рецептах: {result.ingredients}, '
+            f'новых в справочнике: {result.new_ingredients}'))
@@ -1,68 +1,57 @@
-import csv
 import os
-import traceback
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
 
-from core.models import Ingredient
+from core.ingredient_sync import READERS, sync_ingredients
 
 
 class Command(BaseCommand):
-    help = 'Загрузка ингредиентов из CSV-файла'
+    help = ('Загрузка ингредиентов из CSV- или JSON-файла; с --sync '
+            'справочник приводится в соответствие с файлом')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+            help='Путь к файлу, формат определяется по расширению')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Формат файла, если расширение не .csv и не .json')
+        parser.add_argument(
+            '--sync', action='store_true',
+            help='Удалить ингредиенты, которых нет в файле и которые '
+                 'не используются в рецептах')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        file_path = options['file']
+        file_format = (options['format']
+                       or os.path.splitext(file_path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            self.stdout.write(self.style.ERROR(
+                f'Неизвестный формат файла "{file_path}"'))
+            return
+        if not os.path.exists(file_path):
+            self.stdout.write(self.style.ERROR(
+                f'Файл не найден по пути: {file_path}'))
+            return
 
-    def handle(self, *args, **kwargs):
-        file_name = 'ingredients.csv'  # Имя CSV файла
         try:
-            # Формируем путь к файлу 
-            file_path = os.path.join(settings.BASE_DIR, 'data', file_name)
-
-            # Проверяем, существует ли файл
-            if not os.path.exists(file_path):
-                self.stdout.write(self.style.ERROR(
-                    f'Файл "{file_name}" не найден по пути: {file_path}'))
-                return
-
-            # Открываем файл и загружаем данные
             with open(file_path, newline='', encoding='utf-8') as file:
-                csv_reader = csv.DictReader(file)
-
-                # Проверяем заголовки CSV
-                headers = csv_reader.fieldnames
-                self.stdout.write(self.style.SUCCESS(
-                    f"Заголовки в файле: {headers}"))
-
-                if 'name' not in headers or 'measurement_unit' not in headers:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            'Ошибка: Файл CSV не содержит требуемых столбцов'))
-                    return
-
-                ingredients_to_create = [
-                    Ingredient(
-                        name=row['name'].strip(),
-                        measurement_unit=row['measurement_unit'].strip()
-                    ) 
-                    for row in csv_reader
-                ]
-
-            # Массовое создание новых ингредиентов
-            created_ingredients = Ingredient.objects.bulk_create(
-                ingredients_to_create,
-                ignore_conflicts=True  # Игнорировать конфликты
-            )
-
-            # Выводим успешный результат
-            self.stdout.write(self.style.SUCCESS(
-                f'Данные успешно загружены!'
-                f'Добавлено записей: {len(created_ingredients)}'
-            )) 
-
-        except Exception as e:
-            # Выводим полную трассировку ошибки
-            self.stdout.write(self.style.ERROR(
-                f'Произошла ошибка при обработке файла "{file_name}": {str(e)}'
-            ))
-            # Дополнительная информация для диагностики
-            self.stdout.write(self.style.ERROR(
-                f'Полная трассировка ошибки:\n{traceback.format_exc()}'))
+                result = sync_ingredients(
+                    READERS[file_format](file), sync=options['sync'],
+                    batch_size=options['batch_size'])
+        except (ValueError, KeyError, DatabaseError) as error:
+            raise CommandError(
+                f'Ошибка при обработке файла "{file_path}": {error}')
+
+        sync = options['sync']
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {result.read}, пропущено: {result.skipped}\n'
+            f'Добавлено: {result.inserted}\n'
+            f'Без изменений: {result.unchanged}\n'
+            f'{"Удалено" if sync else "Нет в файле"}: {result.stale}\n'
+            f'Нет в файле, но используются в рецептах: '
+            f'{result.stale_in_use}'))
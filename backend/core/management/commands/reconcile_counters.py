@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.cart import rebuild_shopping_lists
+from core.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчёт счётчиков избранного, корзин, рецептов и подписок '
+            'и списков покупок')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = reconcile_counters()
+            shopping_list_items = rebuild_shopping_lists()
+        for counter, rows in fixed.items():
+            style = self.style.WARNING if rows else self.style.SUCCESS
+            self.stdout.write(style(f'{counter}: исправлено строк {rows}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны: позиций {shopping_list_items}'))
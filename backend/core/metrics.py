@@ -0,0 +1,245 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+DB_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 1.0)
+# Имя -> (тип, описание, границы корзин гистограммы)
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Завершённые запросы', None),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса', LATENCY_BUCKETS),
+    'foodgram_http_requests_in_flight': (
+        'gauge', 'Запросы в обработке', None),
+    'foodgram_db_query_duration_seconds': (
+        'histogram', 'Время SQL-запроса', DB_QUERY_BUCKETS),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кэшам: result — hit или miss', None),
+}
+# Счётчики и гистограммы завершившихся воркеров в METRICS_DIR
+DEAD_WORKERS_FILE = 'dead.json'
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ProcessMetrics:
+    """Метрики процесса-воркера в памяти и их снимок в файле.
+
+    Каждый воркер раз в METRICS_FLUSH_INTERVAL секунд записывает свои
+    значения в отдельный файл в METRICS_DIR (по умолчанию на /dev/shm),
+    а /metrics складывает файлы всех воркеров. Счётчики и гистограммы
+    завершившихся воркеров продолжают учитываться, их gauge — нет; см.
+    merge_dead_worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _reset(self):
+        # После fork данные и поток родителя воркеру не нужны
+        self._pid = os.getpid()
+        self._values = {}
+        self._dirty = False
+        self._path = os.path.join(
+            settings.METRICS_DIR, f'{self._pid}-{time.time_ns()}.json')
+        thread = threading.Thread(target=self._flush_loop, daemon=True)
+        thread.start()
+
+    def _update(self, name, labels, update):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            update(key)
+            self._dirty = True
+
+    def inc(self, name, labels, value=1):
+        def update(key):
+            self._values[key] = self._values.get(key, 0) + value
+        self._update(name, labels, update)
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+
+        def update(key):
+            # Счётчики по корзинам без накопления, затем сумма и число
+            if key not in self._values:
+                self._values[key] = [0] * (len(buckets) + 3)
+            counts = self._values[key]
+            counts[bisect_left(buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+        self._update(name, labels, update)
+
+    def flush(self):
+        with self._lock:
+            if self._pid != os.getpid() or not self._dirty:
+                return
+            samples = [
+                [name, labels, value]
+                for (name, labels), value in self._values.items()
+            ]
+            self._dirty = False
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write_json(self._path, samples)
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+
+registry = ProcessMetrics()
+atexit.register(registry.flush)
+
+
+def record_cache(cache, hit):
+    if settings.METRICS_ENABLED:
+        registry.inc('foodgram_cache_requests_total',
+                     {'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+
+def worker_paths(directory, pid='*'):
+    return glob.glob(os.path.join(directory, f'{pid}-*.json'))
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(temporary, path)
+
+
+def add_samples(totals, samples, gauges=True):
+    for name, labels, value in samples:
+        if name not in METRICS or (
+                METRICS[name][0] == 'gauge' and not gauges):
+            continue
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if isinstance(value, list):
+            total = totals.setdefault(key, [0] * len(value))
+            for index, item in enumerate(value):
+                total[index] += item
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def read_dead(directory):
+    """Сумма завершившихся воркеров и имена уже учтённых в ней файлов."""
+    return read_json(os.path.join(directory, DEAD_WORKERS_FILE),
+                     {'samples': [], 'merged': []})
+
+
+def merge_dead_worker(pid, directory=None):
+    """Переносит метрики завершившегося воркера pid в общий файл.
+
+    Счётчики и гистограммы суммируются, gauge отбрасываются. Вызывается
+    мастером gunicorn (child_exit) по одному воркеру за раз. Файл
+    воркера удаляется после записи общего, а collect пропускает файлы,
+    уже учтённые в общем, — значения не теряются и не удваиваются.
+    """
+    directory = directory or settings.METRICS_DIR
+    paths = worker_paths(directory, pid)
+    if not paths:
+        return
+    dead = read_dead(directory)
+    totals = {}
+    add_samples(totals, dead['samples'])
+    for path in paths:
+        add_samples(totals, read_json(path, []), gauges=False)
+    merged = [
+        name for name in dead['merged']
+        if os.path.exists(os.path.join(directory, name))
+    ]
+    write_json(os.path.join(directory, DEAD_WORKERS_FILE), {
+        'samples': [[name, labels, value]
+                    for (name, labels), value in totals.items()],
+        'merged': merged + [os.path.basename(path) for path in paths],
+    })
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def collect():
+    """Сумма значений из файлов всех воркеров и завершившихся воркеров."""
+    registry.flush()
+    directory = settings.METRICS_DIR
+    workers = [(path, read_json(path)) for path in worker_paths(directory)]
+    # Общий файл читается после файлов воркеров: файл, удалённый до
+    # чтения, уже учтён в нём
+    dead = read_dead(directory)
+    merged = set(dead['merged'])
+    totals = {}
+    add_samples(totals, dead['samples'])
+    for path, samples in workers:
+        name = os.path.basename(path)
+        if samples is None or name in merged:
+            continue
+        add_samples(totals, samples,
+                    gauges=process_alive(int(name.split('-')[0])))
+    return totals
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+        for key, value in labels)
+
+
+def render_metrics():
+    """Текстовый формат экспозиции Prometheus."""
+    totals = collect()
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (sample, labels), value in sorted(totals.items()):
+            if sample != name:
+                continue
+            if kind != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), value):
+                cumulative += count
+                lines.append(f'{name}_bucket'
+                             f'{format_labels((*labels, ("le", bound)))} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
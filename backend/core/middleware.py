@@ -0,0 +1,225 @@
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .metrics import registry
+
+logger = logging.getLogger('foodgram.slow_requests')
+
+# Литералы и списки параметров не различают «одинаковые» запросы
+SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_IN_LIST_RE = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+SQL_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    sql = SQL_LITERAL_RE.sub('?', sql)
+    sql = SQL_IN_LIST_RE.sub('IN (...)', sql)
+    return SQL_SPACES_RE.sub(' ', sql).strip()
+
+
+class QueryStats:
+    """Число запросов и время в БД, собранные record_query."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.queries.append((sql, duration))
+
+    def top(self, limit):
+        grouped = defaultdict(lambda: [0, 0.0])
+        for sql, duration in self.queries:
+            group = grouped[normalize_sql(sql)]
+            group[0] += 1
+            group[1] += duration
+        top = sorted(grouped.items(), key=lambda item: -item[1][1])[:limit]
+        return [
+            {'sql': sql, 'count': count, 'ms': round(duration * 1000, 2)}
+            for sql, (count, duration) in top
+        ]
+
+
+# QueryStats запросов, которые сейчас собирают статистику. Переменная
+# контекста видна и в потоке sync_to_async, где под ASGI выполняются
+# запросы к БД, и не смешивает одновременные запросы
+active_stats = ContextVar('active_query_stats', default=())
+
+
+def record_query(execute, sql, params, many, context):
+    """Обёртка execute, постоянно стоящая на соединениях с БД."""
+    collectors = active_stats.get()
+    if not collectors:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for stats in collectors:
+            stats.add(sql, duration)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def enable_query_recording():
+    """Ставит record_query на новые и уже открытые в потоке соединения."""
+    connection_created.connect(
+        install_query_recorder, dispatch_uid='core.middleware.record_query')
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(connection)
+
+
+@contextmanager
+def collect_queries():
+    stats = QueryStats()
+    token = active_stats.set((*active_stats.get(), stats))
+    try:
+        yield stats
+    finally:
+        active_stats.reset(token)
+
+
+class SQLInstrumentationMiddleware:
+    """Число SQL-запросов и время в БД для каждого запроса.
+
+    Итог уходит в заголовок Server-Timing, а запросы дольше
+    SLOW_REQUEST_MS пишутся в лог foodgram.slow_requests одной строкой
+    JSON с самыми долгими запросами, сгруппированными по тексту без
+    литералов. При SQL_INSTRUMENTATION=False middleware исключается из
+    цепочки при запуске и ничего не стоит. Работает и под WSGI, и под
+    ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SQL_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.slow_ms = settings.SLOW_REQUEST_MS
+        self.top_queries = settings.SLOW_REQUEST_TOP_QUERIES
+        enable_query_recording()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with collect_queries() as stats:
+            response = self.get_response(request)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with collect_queries() as stats:
+            response = await self.get_response(request)
+        return self.finish(request, response, stats, started)
+
+    def finish(self, request, response, stats, started):
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = stats.duration * 1000
+        response['Server-Timing'] = (
+            f'db;dur={db_ms:.1f};desc="{stats.count} queries", '
+            f'app;dur={total_ms:.1f}')
+        if total_ms >= self.slow_ms:
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(total_ms, 1),
+                'db_ms': round(db_ms, 1),
+                'queries': stats.count,
+                'top_queries': stats.top(self.top_queries),
+            }, ensure_ascii=False))
+        return response
+
+
+class MetricsMiddleware:
+    """Метрики запросов для /metrics по имени маршрута DRF.
+
+    Метка view — имя маршрута вида recipe-list или
+    recipe-download-shopping-cart, для запросов без маршрута —
+    unmatched. Время потоковых ответов считается до начала отправки тела.
+    Работает и под WSGI, и под ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Синхронный process_view Django вызывал бы через sync_to_async
+            self.process_view = self.aprocess_view
+        enable_query_recording()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = request.resolver_match.view_name
+        registry.inc('foodgram_http_requests_in_flight',
+                     {'view': request.metrics_view})
+
+    async def aprocess_view(self, request, *args):
+        MetricsMiddleware.process_view(self, request, *args)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        try:
+            with collect_queries() as stats:
+                response = self.get_response(request)
+        finally:
+            self.view_finished(request)
+        return self.record(request, response, stats, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        try:
+            with collect_queries() as stats:
+                response = await self.get_response(request)
+        finally:
+            self.view_finished(request)
+        return self.record(request, response, stats, started)
+
+    def view_finished(self, request):
+        view = getattr(request, 'metrics_view', None)
+        if view is not None:
+            registry.inc('foodgram_http_requests_in_flight',
+                         {'view': view}, -1)
+
+    def record(self, request, response, stats, started):
+        duration = time.perf_counter() - started
+        labels = {'view': getattr(request, 'metrics_view', 'unmatched'),
+                  'method': request.method}
+        registry.inc('foodgram_http_requests_total',
+                     {**labels, 'status': str(response.status_code)})
+        registry.observe('foodgram_http_request_duration_seconds',
+                         labels, duration)
+        for _, query_duration in stats.queries:
+            registry.observe('foodgram_db_query_duration_seconds',
+                             {'view': labels['view']}, query_duration)
+        return response
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('Favorite', 'Recipe', 'recipe', 'favorites_count'),
+    ('ShopCart', 'Recipe', 'recipe', 'shopping_carts_count'),
+    ('Recipe', 'SiteUser', 'author', 'recipes_count'),
+    ('Subscription', 'SiteUser', 'author', 'subscribers_count'),
+    ('Subscription', 'SiteUser', 'user', 'subscriptions_count'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for source_name, target_name, relation, field in COUNTERS:
+        source = apps.get_model('core', source_name)
+        target = apps.get_model('core', target_name)
+        total = (source.objects.filter(**{relation: OuterRef('pk')})
+                 .order_by().values(relation)
+                 .annotate(total=Count('pk')).values('total'))
+        target.objects.update(**{field: Coalesce(
+            Subquery(total, output_field=IntegerField()), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddField(
+            model_name='siteuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.AddField(
+            model_name='siteuser',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='siteuser',
+            name='subscriptions_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants_for',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Копии изображения созданы для'),
+        ),
+        migrations.AddField(
+            model_name='siteuser',
+            name='avatar_variants_for',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Копии аватарки созданы для'),
+        ),
+    ]
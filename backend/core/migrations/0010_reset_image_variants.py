@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def reset_variant_markers(apps, schema_editor):
+    # Копии теперь называются по имени файла с расширением: до запуска
+    # generate_image_variants ссылки ведут на исходные файлы
+    apps.get_model('core', 'Recipe').objects.exclude(
+        image_variants_for='').update(image_variants_for='')
+    apps.get_model('core', 'SiteUser').objects.exclude(
+        avatar_variants_for='').update(avatar_variants_for='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_catalog_revision'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_variant_markers,
+                             migrations.RunPython.noop),
+    ]
@@ -2,12 +2,16 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Case, Exists, OuterRef, Prefetch, Value, When
 from django.utils.timezone import now
 
 # Импортируем константы
 from .constants import (AVATAR_UPLOAD_PATH,
+                        FEED_PER_AUTHOR_MAX_SUBSCRIPTIONS,
+                        IMAGE_NAME_MAX_LENGTH,
                         INGREDIENT_MEASUREMENT_UNIT_MAX_LENGTH,
                         INGREDIENT_NAME_MAX_LENGTH,
+                        PUB_DATE_UPDATE_BATCH_SIZE,
                         RECIPE_COOKING_TIME_MIN_VALUE,
                         RECIPE_IMAGE_UPLOAD_PATH,
                         RECIPE_INGREDIENT_AMOUNT_MIN_VALUE,
@@ -16,8 +20,31 @@ from .constants import (AVATAR_UPLOAD_PATH,
                         USER_USERNAME_MAX_LENGTH)
 
 
+class KeepDerivedFieldsOnSaveMixin:
+    """Полный save() существующей записи не откатывает производные поля.
+
+    Счётчики меняет только core.counters через F(), отметки о копиях
+    изображений — фоновый поток из core.images, а в загруженном объекте
+    их значения могут устареть. Перед полным сохранением они
+    перечитываются из БД; в остальном save() ведёт себя как обычно.
+    """
+    derived_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')
+                and not self._state.adding):
+            # Строку могли удалить: тогда save() вставит её, как обычно
+            current = type(self)._base_manager.using(
+                kwargs.get('using') or self._state.db).filter(
+                pk=self.pk).values(*self.derived_fields).first()
+            for name, value in (current or {}).items():
+                setattr(self, name, value)
+        super().save(*args, **kwargs)
+
+
 # Кастомная модель пользователя
-class SiteUser(AbstractUser):
+class SiteUser(KeepDerivedFieldsOnSaveMixin, AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
     avatar = models.ImageField(
@@ -26,6 +53,14 @@ class SiteUser(AbstractUser):
         null=True,
         verbose_name='Аватарка',
     )
+    # Имя аватарки, для которой созданы копии (см. core.images)
+    avatar_variants_for = models.CharField(
+        max_length=IMAGE_NAME_MAX_LENGTH,
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Копии аватарки созданы для',
+    )
     email = models.EmailField(
         max_length=USER_EMAIL_MAX_LENGTH,
         unique=True,
@@ -45,6 +80,25 @@ class SiteUser(AbstractUser):
         max_length=USER_LAST_NAME_MAX_LENGTH,
         verbose_name='Фамилия',
     )
+    # Счётчики поддерживаются сигналами из core.counters
+    # и вместе с отметкой о копиях не пишутся обычным save()
+    derived_fields = ('avatar_variants_for', 'recipes_count',
+                      'subscribers_count', 'subscriptions_count')
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов',
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков',
+    )
+    subscriptions_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписок',
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -87,8 +141,77 @@ class Ingredient(models.Model):
         return f'{self.name} ({self.measurement_unit})'
 
 
+# Версия справочника ингредиентов; одна строка, общая для всех процессов
+class CatalogRevision(models.Model):
+    value = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Версия',
+    )
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочника'
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        """Автор одним JOIN, ингредиенты одним запросом на страницу."""
+        return self.select_related('author').prefetch_related(
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient').order_by('id'),
+            )
+        )
+
+    def with_user_flags(self, user):
+        """Флаги is_favorited, is_in_shopping_cart и подписки на автора."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_is_subscribed=Value(False),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShopCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
+
+    def followed_by(self, user):
+        """Рецепты авторов, на которых подписан user.
+
+        При немногих подписках рецепты каждого автора берутся по индексу
+        (author, pub_date, id). При тысячах подписок это почти все рецепты,
+        поэтому выгоднее идти по индексу даты и проверять подписку:
+        обход останавливается, как только набрана страница.
+        """
+        subscriptions = Subscription.objects.filter(user=user)
+        if user.subscriptions_count <= FEED_PER_AUTHOR_MAX_SUBSCRIPTIONS:
+            return self.filter(author__in=subscriptions.values('author'))
+        return self.filter(
+            Exists(subscriptions.filter(author=OuterRef('author'))))
+
+    def set_pub_dates(self, pub_dates):
+        """Проставляет даты публикации {id: дата} после bulk_create.
+
+        bulk_create заменяет pub_date текущим временем (auto_now_add),
+        поэтому загрузка и генерация задают даты отдельными UPDATE.
+        """
+        items = list(pub_dates.items())
+        for start in range(0, len(items), PUB_DATE_UPDATE_BATCH_SIZE):
+            batch = dict(items[start:start + PUB_DATE_UPDATE_BATCH_SIZE])
+            self.filter(pk__in=batch).update(pub_date=Case(
+                *(When(pk=pk, then=Value(pub_date))
+                  for pk, pub_date in batch.items()),
+                output_field=models.DateTimeField()))
+
+
 # Модель рецепта
-class Recipe(models.Model):
+class Recipe(KeepDerivedFieldsOnSaveMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -103,6 +226,14 @@ class Recipe(models.Model):
         upload_to=RECIPE_IMAGE_UPLOAD_PATH,
         verbose_name='Изображение',
     )
+    # Имя изображения, для которого созданы копии (см. core.images)
+    image_variants_for = models.CharField(
+        max_length=IMAGE_NAME_MAX_LENGTH,
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Копии изображения созданы для',
+    )
     text = models.TextField(
         verbose_name='Описание',
     )
@@ -114,11 +245,40 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации',
     )
+    # Индекс похожих рецептов дочитывает изменённые после прошлой сверки
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения',
+    )
+    # Счётчики поддерживаются сигналами из core.counters
+    # и вместе с отметкой о копиях не пишутся обычным save()
+    derived_fields = ('image_variants_for', 'favorites_count',
+                      'shopping_carts_count')
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    shopping_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В корзинах',
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            # Лента подписок: последние рецепты выбранных авторов
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -243,4 +403,37 @@ class RecipeIngredient(models.Model):
         verbose_name_plural = 'Ингредиенты рецептов'
 
     def __str__(self):
-        return f'{self.amount} {self.ingredient} в {self.recipe.name}'
\ No newline at end of file
+        return f'{self.amount} {self.ingredient} в {self.recipe.name}'
+
+
+# Итоговый список покупок пользователя: сумма ингредиентов рецептов корзины
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item',
+            ),
+        ]
+        ordering = ['user']
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+
+    def __str__(self):
+        return f'{self.user.username}: {self.amount} {self.ingredient}'
\ No newline at end of file
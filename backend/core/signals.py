@@ -0,0 +1,161 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .cart import (bump_cart_versions, bump_cart_versions_for_recipe,
+                   change_shopping_list)
+from .catalog import bump_catalog_version
+from .constants import AVATAR_VARIANTS, RECIPE_IMAGE_VARIANTS
+from .counters import COUNTERS, update_counters
+from .images import mark_variants_ready, schedule_variants
+from .models import (Ingredient, Recipe, RecipeIngredient, ShopCart,
+                     SiteUser)
+from .versions import bump_recipe_versions, bump_token_versions
+
+# Поля профиля, которые видны во вложенном авторе рецепта
+AUTHOR_PROFILE_FIELDS = {'email', 'username', 'first_name', 'last_name',
+                         'avatar'}
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    # Воркеры перестраивают снимок только после фиксации изменений
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=ShopCart)
+@receiver(post_delete, sender=ShopCart)
+def shopping_cart_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_cart_versions([instance.user_id]))
+
+
+@receiver(post_save, sender=ShopCart)
+def recipe_added_to_cart(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_shopping_list(instance.user_id, instance.recipe_id, 1)
+
+
+@receiver(pre_delete, sender=ShopCart)
+def recipe_removed_from_cart(sender, instance, **kwargs):
+    # pre_delete: при каскадном удалении рецепта его ингредиенты ещё на месте
+    change_shopping_list(instance.user_id, instance.recipe_id, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def cart_recipe_changed(sender, instance, created, **kwargs):
+    # Название и автор рецепта попадают в выгрузку корзины. Списки
+    # покупок пересобирает тот, кто меняет состав (API и RecipeAdmin)
+    if not created:
+        transaction.on_commit(
+            lambda: bump_cart_versions_for_recipe(instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_recipe_versions([instance.pk]))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_recipe_versions([instance.recipe_id]))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_touched(sender, instance, origin=None, **kwargs):
+    # Строку правят и без сохранения рецепта (RecipeIngredientAdmin);
+    # индекс похожих рецептов дочитывает изменения по updated_at.
+    # При удалении самих рецептов отмечать нечего
+    if getattr(origin, 'model', type(origin)) is Recipe:
+        return
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        updated_at=timezone.now())
+
+
+def bump_versions_of(recipes):
+    recipe_ids = list(recipes.values_list('id', flat=True))
+    if recipe_ids:
+        bump_recipe_versions(recipe_ids)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: bump_versions_of(
+            Recipe.objects.filter(recipe_ingredients__ingredient=instance)))
+
+
+@receiver(post_save, sender=SiteUser)
+def author_profile_changed(sender, instance, created, update_fields=None,
+                           **kwargs):
+    # Вход в систему сохраняет только last_login — рецепты не меняются
+    if created or update_fields and not (
+            AUTHOR_PROFILE_FIELDS & set(update_fields)):
+        return
+    transaction.on_commit(lambda: bump_versions_of(instance.recipes.all()))
+
+
+@receiver(post_save, sender=SiteUser)
+def token_user_changed(sender, instance, created, update_fields=None,
+                       **kwargs):
+    # Пароль, активность и профиль: запись кэша аутентификации
+    # отзывается. Вход меняет только last_login
+    if created or update_fields and set(update_fields) == {'last_login'}:
+        return
+    transaction.on_commit(lambda: bump_token_versions(
+        Token.objects.filter(user=instance).values_list('key', flat=True)))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    # Выход (token/logout) и каскадное удаление пользователя
+    transaction.on_commit(lambda: bump_token_versions([instance.key]))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(sender, instance, raw=False, **kwargs):
+    name = instance.image.name
+    if raw or instance.image_variants_for == name:
+        return
+
+    def on_ready():
+        recipe = Recipe.objects.filter(pk=instance.pk)
+        if mark_variants_ready(recipe, 'image', name):
+            bump_recipe_versions([instance.pk])
+
+    schedule_variants(name, RECIPE_IMAGE_VARIANTS, on_ready=on_ready)
+
+
+@receiver(post_save, sender=SiteUser)
+def avatar_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    name = instance.avatar.name
+    if (raw or update_fields and 'avatar' not in update_fields
+            or instance.avatar_variants_for == name):
+        return
+
+    def on_ready():
+        user = SiteUser.objects.filter(pk=instance.pk)
+        if mark_variants_ready(user, 'avatar', name):
+            bump_versions_of(instance.recipes.all())
+
+    schedule_variants(name, AVATAR_VARIANTS, on_ready=on_ready)
+
+
+def counted_row_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_counters(sender, [instance], 1)
+
+
+def counted_row_deleted(sender, instance, **kwargs):
+    # Срабатывает и при каскадном удалении
+    update_counters(sender, [instance], -1)
+
+
+for counted_model in COUNTERS:
+    post_save.connect(counted_row_saved, sender=counted_model)
+    post_delete.connect(counted_row_deleted, sender=counted_model)
@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import short_link
+from .views import ashort_link, metrics, short_link
 
 urlpatterns = [
     path(
-        's/<int:pk>', short_link, name='short_link'),
+        's/<int:pk>', ashort_link if settings.ASYNC_VIEWS else short_link,
+        name='short_link'),
+    path('metrics', metrics, name='metrics'),
 ]
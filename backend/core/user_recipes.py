@@ -0,0 +1,162 @@
+from collections import namedtuple
+
+from django.db import connection, transaction
+
+from .cart import (bump_cart_versions, change_shopping_list,
+                   rebuild_shopping_lists)
+from .counters import COUNTERS, update_counters
+from .models import Recipe, ShopCart, SiteUser
+
+ShortRecipe = namedtuple('ShortRecipe', ('id', 'name', 'author'))
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def column(model, field):
+    return qn(model._meta.get_field(field).column)
+
+
+def change_recipe_counter(cursor, model, recipe_id, delta):
+    """Меняет счётчик рецепта и возвращает краткое описание рецепта."""
+    (_, _, field), = COUNTERS[model]
+    recipe = qn(Recipe._meta.db_table)
+    cursor.execute(
+        f'UPDATE {recipe} SET {qn(field)} = {qn(field)} + %s '
+        f'WHERE {column(Recipe, "id")} = %s '
+        f'RETURNING {column(Recipe, "id")}, {column(Recipe, "name")}, '
+        f'(SELECT {column(SiteUser, "username")} '
+        f'FROM {qn(SiteUser._meta.db_table)} '
+        f'WHERE {column(SiteUser, "id")} = '
+        f'{recipe}.{column(Recipe, "author")})',
+        [delta, recipe_id])
+    row = cursor.fetchone()
+    return ShortRecipe(*row) if row else None
+
+
+def after_change(model, user_id, recipe_id, sign):
+    # Сигналы не отправляются: их работу делаем здесь
+    if model is ShopCart:
+        change_shopping_list(user_id, recipe_id, sign)
+        transaction.on_commit(lambda: bump_cart_versions([user_id]))
+
+
+def add_user_recipe(model, user_id, recipe_id):
+    """Добавляет рецепт в избранное или корзину.
+
+    Повтор определяется по уникальному ограничению (ON CONFLICT DO
+    NOTHING), а не предварительной проверкой. Возвращает ShortRecipe
+    или None, если рецепт уже добавлен; рецепта нет — Recipe.DoesNotExist.
+    """
+    table = qn(model._meta.db_table)
+    user_column, recipe_column = (
+        column(model, 'user'), column(model, 'recipe'))
+    with transaction.atomic(), connection.cursor() as cursor:
+        # WHERE обязателен: без него SQLite путает ON CONFLICT с JOIN
+        cursor.execute(
+            f'INSERT INTO {table} ({user_column}, {recipe_column}) '
+            f'SELECT %s, {column(Recipe, "id")} '
+            f'FROM {qn(Recipe._meta.db_table)} '
+            f'WHERE {column(Recipe, "id")} = %s '
+            f'ON CONFLICT ({user_column}, {recipe_column}) DO NOTHING '
+            f'RETURNING {column(model, "id")}',
+            [user_id, recipe_id])
+        if cursor.fetchone() is None:
+            if not Recipe.objects.filter(pk=recipe_id).exists():
+                raise Recipe.DoesNotExist
+            return None
+        recipe = change_recipe_counter(cursor, model, recipe_id, 1)
+        after_change(model, user_id, recipe_id, 1)
+    return recipe
+
+
+def remove_user_recipe(model, user_id, recipe_id):
+    """Убирает рецепт одним DELETE; False, если его там не было."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {qn(model._meta.db_table)} '
+            f'WHERE {column(model, "user")} = %s '
+            f'AND {column(model, "recipe")} = %s',
+            [user_id, recipe_id])
+        if not cursor.rowcount:
+            return False
+        change_recipe_counter(cursor, model, recipe_id, -1)
+        after_change(model, user_id, recipe_id, -1)
+    return True
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def after_bulk_change(model, user_id, recipe_ids, delta):
+    """Счётчики и список покупок после массового изменения."""
+    update_counters(
+        model, [model(user_id=user_id, recipe_id=pk) for pk in recipe_ids],
+        delta)
+    if model is ShopCart:
+        rebuild_shopping_lists([user_id])
+        transaction.on_commit(lambda: bump_cart_versions([user_id]))
+
+
+def add_user_recipes(model, user_id, recipe_ids):
+    """Добавляет несколько рецептов одним INSERT ... ON CONFLICT.
+
+    Возвращает {id: 'added' | 'already_added' | 'not_found'} в порядке
+    переданных id.
+    """
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    table = qn(model._meta.db_table)
+    user_column, recipe_column = (
+        column(model, 'user'), column(model, 'recipe'))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({user_column}, {recipe_column}) '
+            f'SELECT %s, {column(Recipe, "id")} '
+            f'FROM {qn(Recipe._meta.db_table)} '
+            f'WHERE {column(Recipe, "id")} IN ({placeholders(recipe_ids)}) '
+            f'ON CONFLICT ({user_column}, {recipe_column}) DO NOTHING '
+            f'RETURNING {recipe_column}',
+            [user_id, *recipe_ids])
+        added = {pk for pk, in cursor.fetchall()}
+        missing = set(recipe_ids) - added
+        if missing:
+            # Не вставились: либо уже добавлены, либо рецепта нет
+            missing -= set(Recipe.objects.filter(
+                pk__in=missing).values_list('pk', flat=True))
+        if added:
+            after_bulk_change(model, user_id, added, 1)
+    return {
+        pk: 'added' if pk in added else (
+            'not_found' if pk in missing else 'already_added')
+        for pk in recipe_ids
+    }
+
+
+def remove_user_recipes(model, user_id, recipe_ids=None):
+    """Убирает рецепты одним DELETE; None — все рецепты пользователя.
+
+    Возвращает {id: 'removed' | 'not_added'} для переданных id или
+    {id: 'removed'} для удалённых, если id не переданы.
+    """
+    query = (f'DELETE FROM {qn(model._meta.db_table)} '
+             f'WHERE {column(model, "user")} = %s')
+    params = [user_id]
+    if recipe_ids is not None:
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        query += (f' AND {column(model, "recipe")} '
+                  f'IN ({placeholders(recipe_ids)})')
+        params.extend(recipe_ids)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'{query} RETURNING {column(model, "recipe")}', params)
+        removed = [pk for pk, in cursor.fetchall()]
+        if removed:
+            after_bulk_change(model, user_id, removed, -1)
+    if recipe_ids is None:
+        return dict.fromkeys(removed, 'removed')
+    removed = set(removed)
+    return {
+        pk: 'removed' if pk in removed else 'not_added' for pk in recipe_ids
+    }
@@ -0,0 +1,51 @@
+import time
+
+from django.core.cache import cache
+
+from .constants import (AUTH_TOKEN_VERSION_KEY, RECIPE_LIST_VERSION_KEY,
+                        RECIPE_VERSION_KEY)
+
+
+def get_version(key):
+    """Версия данных, хранящаяся в кэше Django под ключом key.
+
+    При общем бэкенде кэша версию видят все воркеры. Если ключа нет
+    (первый запуск или вытеснение), версия начинается с отметки времени,
+    чтобы не совпасть ни с одной из прежних.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(keys):
+    """Выдаёт ключам новые версии; всё, что кэшировано под старыми, устаревает.
+
+    Новое значение — отметка времени, а не incr: запись атомарна и
+    для файлового бэкенда, где incr делается через чтение и запись.
+    """
+    version = time.time_ns()
+    cache.set_many({key: version for key in keys}, timeout=None)
+
+
+def recipe_version_key(recipe_id):
+    return f'{RECIPE_VERSION_KEY}:{recipe_id}'
+
+
+def bump_recipe_versions(recipe_ids):
+    """Отмечает изменение рецептов и, значит, всех страниц списка."""
+    bump_versions([RECIPE_LIST_VERSION_KEY,
+                   *map(recipe_version_key, recipe_ids)])
+
+
+def token_version_key(token_key):
+    return f'{AUTH_TOKEN_VERSION_KEY}:{token_key}'
+
+
+def bump_token_versions(token_keys):
+    """Отмечает, что токены или их пользователи изменились."""
+    token_keys = list(token_keys)
+    if token_keys:
+        bump_versions(map(token_version_key, token_keys))
@@ -1,8 +1,27 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
 
+from .metrics import render_metrics
 from .models import Recipe
 
 
 def short_link(request, pk):
     recipe = get_object_or_404(Recipe, pk=pk)
     return redirect(recipe.get_absolute_url())
+
+
+async def ashort_link(request, pk):
+    try:
+        recipe = await Recipe.objects.only('id').aget(pk=pk)
+    except Recipe.DoesNotExist:
+        raise Http404
+    return redirect(recipe.get_absolute_url())
+
+
+def metrics(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(render_metrics(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
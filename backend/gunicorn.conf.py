@@ -0,0 +1,22 @@
+import os
+
+# Число воркеров задаёт переменная WEB_CONCURRENCY
+bind = '0.0.0.0:8000'
+
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'config.wsgi:application'
+
+
+def child_exit(server, worker):
+    # Метрики завершившегося воркера переходят в общий файл, иначе файлы
+    # каждого перезапуска копились бы в METRICS_DIR
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    from django.conf import settings
+
+    from core.metrics import merge_dead_worker
+
+    if settings.METRICS_ENABLED:
+        merge_dead_worker(worker.pid)
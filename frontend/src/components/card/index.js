@@ -10,6 +10,7 @@ const Card = ({
   name = "Без названия",
   id,
   image,
+  image_thumbnail,
   is_favorited,
   is_in_shopping_cart,
   cooking_time,
@@ -44,7 +45,7 @@ const Card = ({
         title={
           <div
             className={styles.card__image}
-            style={{ backgroundImage: `url(${image})` }}
+            style={{ backgroundImage: `url(${image_thumbnail || image})` }}
           />
         }
       />
@@ -65,7 +66,7 @@ const Card = ({
           <div
             className={styles["card__author-image"]}
             style={{
-              "background-image": `url(${author.avatar || DefaultImage})`,
+              "background-image": `url(${author.avatar_thumbnail || author.avatar || DefaultImage})`,
             }}
           />
           <div className={styles.card__author}>